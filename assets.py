@@ -0,0 +1,214 @@
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+from flask import request, send_from_directory, url_for, abort
+from werkzeug.security import safe_join
+
+# Brotli and the JavaScript minifier are optional: without them the build only writes gzip siblings and bundles
+# the scripts without minifying them
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+# Stylesheets and scripts every page loads, in the order they must be applied, bundled into one file each.
+# Paths are relative to the static folder
+BUNDLES = {
+    "site.css": (
+        "assets/vendor/animate.css/animate.min.css",
+        "assets/vendor/bootstrap/css/bootstrap.min.css",
+        "assets/vendor/bootstrap-icons/bootstrap-icons.css",
+        "assets/vendor/boxicons/css/boxicons.min.css",
+        "assets/vendor/glightbox/css/glightbox.min.css",
+        "assets/vendor/remixicon/remixicon.css",
+        "assets/vendor/swiper/swiper-bundle.min.css",
+        "assets/css/style.css",
+    ),
+    "site.js": (
+        "assets/vendor/bootstrap/js/bootstrap.bundle.min.js",
+        "assets/vendor/glightbox/js/glightbox.min.js",
+        "assets/vendor/isotope-layout/isotope.pkgd.min.js",
+        "assets/vendor/php-email-form/validate.js",
+        "assets/vendor/swiper/swiper-bundle.min.js",
+        "assets/vendor/waypoints/noframework.waypoints.js",
+        "assets/js/main.js",
+    ),
+}
+
+# Folders of the static folder whose files are all fingerprinted, so templates can link them through static_url()
+FINGERPRINTED_FOLDERS = ("assets/img",)
+
+# Extensions worth precompressing. Images and woff/woff2 fonts are compressed already
+COMPRESSIBLE = (".css", ".js", ".svg", ".ttf", ".eot", ".ico", ".json", ".txt")
+
+# Sent with every fingerprinted file: its name changes whenever its content does, so it can be cached forever
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# url(...) references in a stylesheet
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+# Comments other than /*! license comments */
+CSS_COMMENT = re.compile(r"/\*(?!!).*?\*/", re.DOTALL)
+# Source map comments, which would point at the wrong file once bundled
+SOURCE_MAP = re.compile(r"^\s*(//[#@] sourceMappingURL=.*|/\*[#@] sourceMappingURL=.*?\*/)\s*$", re.MULTILINE)
+
+
+def fingerprint(content):
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def fingerprinted_name(path, content):
+    # assets/img/logo.png -> assets/img/logo.<hash>.png
+    stem, extension = posixpath.splitext(path)
+    return f"{stem}.{fingerprint(content)}{extension}"
+
+
+def minify_css(css):
+    # Conservative minification: drop comments and collapse whitespace, leaving everything that could change the
+    # meaning of a selector or a value alone
+    css = CSS_COMMENT.sub("", SOURCE_MAP.sub("", css))
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};,>])\s*", r"\1", css).strip()
+
+
+def minify_js(js):
+    js = SOURCE_MAP.sub("", js)
+    return rjsmin.jsmin(js, keep_bang_comments=True) if rjsmin is not None else js
+
+
+class Assets:
+    # Builds fingerprinted, bundled and precompressed copies of the static files into static/dist, and serves them
+    # with immutable caching. Templates link them through static_url() and asset_urls(), which fall back to the
+    # plain static files until flask build-assets has been run. Follows the init_app pattern of the other extensions
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.folder = os.path.join(app.static_folder, "dist")
+        self.manifest_path = os.path.join(self.folder, "manifest.json")
+        self.load()
+        # Registered on the app rather than the blueprint, and more specific than /static/<path:filename>, so it
+        # takes precedence over the plain static route
+        app.add_url_rule(f"{app.static_url_path}/dist/<path:filename>", "dist", self.send)
+        app.add_template_global(self.static_url, "static_url")
+        app.add_template_global(self.asset_urls, "asset_urls")
+        app.extensions['assets'] = self
+
+    def load(self):
+        # Read the manifest written by the last build, mapping each source path to its fingerprinted copy
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+
+    def static_url(self, filename):
+        # Drop-in replacement for url_for('static', filename=...) that links the fingerprinted copy once built
+        if filename in self.manifest:
+            return url_for("dist", filename=self.manifest[filename])
+        return url_for("static", filename=filename)
+
+    def asset_urls(self, bundle):
+        # URL of a built bundle, or the URLs of the files it is made of until it has been built
+        if bundle in self.manifest:
+            return [url_for("dist", filename=self.manifest[bundle])]
+        return [url_for("static", filename=filename) for filename in BUNDLES[bundle]]
+
+    def send(self, filename):
+        # Serve a fingerprinted file, as its brotli or gzip sibling when the client accepts one
+        path = safe_join(self.folder, filename)
+        if path is None or not os.path.isfile(path) or filename == "manifest.json":
+            return abort(404)
+        encoding = None
+        for candidate, extension in (("br", ".br"), ("gzip", ".gz")):
+            if candidate in request.accept_encodings and os.path.isfile(path + extension):
+                encoding = candidate
+                filename += extension
+                break
+        # The content type comes from the original name, not the .br or .gz one
+        original_name = filename.removesuffix(".br").removesuffix(".gz")
+        response = send_from_directory(self.folder, filename, download_name=original_name)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def build(self):
+        # Write the bundles, their dependencies and every file of FINGERPRINTED_FOLDERS to static/dist under
+        # content-hashed names, each with its precompressed siblings, replacing the previous build.
+        # Returns {name: (path, size, gzip size, brotli size)} of what was written
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder)
+        manifest = {}
+        written = {}
+        for folder in FINGERPRINTED_FOLDERS:
+            for directory, _, filenames in os.walk(os.path.join(self.static_folder, folder)):
+                for filename in sorted(filenames):
+                    source = os.path.relpath(os.path.join(directory, filename), self.static_folder)
+                    source = source.replace(os.sep, "/")
+                    with open(os.path.join(self.static_folder, source), "rb") as source_file:
+                        manifest[source] = self.write(source, source_file.read(), written)
+        for bundle, sources in BUNDLES.items():
+            parts = []
+            for source in sources:
+                with open(os.path.join(self.static_folder, source), encoding="utf-8") as source_file:
+                    content = source_file.read()
+                if bundle.endswith(".css"):
+                    parts.append(minify_css(self.rewrite_css_urls(source, content, manifest, written)))
+                else:
+                    parts.append(minify_js(content))
+            # Scripts are separated by ; so one without a trailing semicolon can't run into the next
+            separator = "\n" if bundle.endswith(".css") else "\n;\n"
+            manifest[bundle] = self.write(bundle, separator.join(parts).encode("utf-8"), written)
+        with open(self.manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+        self.manifest = manifest
+        return written
+
+    def rewrite_css_urls(self, source, css, manifest, written):
+        # Fingerprint the fonts and images a stylesheet refers to and point its url()s at the copies, which sit
+        # next to the bundle in static/dist
+        def replace(match):
+            url = match.group(2).strip()
+            if url.startswith(("data:", "http:", "https:", "//", "/", "#")):
+                return match.group(0)
+            path = re.split(r"[?#]", url, maxsplit=1)[0]
+            fragment = url[url.index("#"):] if "#" in url else ""
+            dependency = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+            if dependency not in manifest:
+                with open(os.path.join(self.static_folder, dependency), "rb") as dependency_file:
+                    manifest[dependency] = self.write(dependency, dependency_file.read(), written)
+            return f'url("{manifest[dependency]}{fragment}")'
+        return CSS_URL.sub(replace, css)
+
+    def write(self, name, content, written):
+        # Write content under its fingerprinted name, plus .gz and .br siblings for text files when they save at
+        # least a tenth of the size. Returns the fingerprinted name
+        target = fingerprinted_name(name, content)
+        path = os.path.join(self.folder, target)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as target_file:
+            target_file.write(content)
+        sizes = [None, None]
+        if name.endswith(COMPRESSIBLE):
+            # mtime=0 keeps the gzip output the same from one build to the next
+            compressed = [gzip.compress(content, compresslevel=9, mtime=0),
+                          brotli.compress(content, quality=11) if brotli is not None else None]
+            for index, (extension, data) in enumerate(zip((".gz", ".br"), compressed)):
+                if data is not None and len(data) < len(content) * 0.9:
+                    with open(path + extension, "wb") as compressed_file:
+                        compressed_file.write(data)
+                    sizes[index] = len(data)
+        written[name] = (target, len(content), *sizes)
+        return target
@@ -0,0 +1,62 @@
+# Measures how long a new worker takes to start: importing main2, creating the app and serving its first page, each
+# in a fresh interpreter against an existing database. Run from the repository root:
+#
+#     python -m benchmarks.import_time [--runs 10] [--repo PATH]
+#
+# --repo measures another checkout of the app instead, e.g. a git worktree of an older commit to compare against
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Creates the schema once, so the timed runs start against an existing database like a restarted worker does. Trees
+# from before the app factory create it as a side effect of the import
+SETUP = """
+import main2
+if hasattr(main2, "create_app"):
+    with main2.create_app().app_context():
+        main2.create_schema()
+"""
+
+# One timed start, printing the seconds spent importing, creating the app and serving the first page
+BOOT = """
+import time
+start = time.perf_counter()
+import main2
+imported = time.perf_counter()
+app = main2.create_app() if hasattr(main2, "create_app") else main2.app
+created = time.perf_counter()
+app.test_client().get("/")
+served = time.perf_counter()
+print(imported - start, created - imported, served - created)
+"""
+
+STAGES = ("import", "create app", "first request")
+
+
+def run(code, repo, environment):
+    return subprocess.run([sys.executable, "-c", code], cwd=repo, env=environment, check=True,
+                          capture_output=True, text=True).stdout
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10, help="timed starts")
+    parser.add_argument("--repo", default=os.getcwd(), help="checkout of the app to measure")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        environment = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        run(SETUP, args.repo, environment)
+        timings = [[float(seconds) * 1000 for seconds in run(BOOT, args.repo, environment).split()]
+                   for _ in range(args.runs)]
+    for index, stage in enumerate(STAGES):
+        stage_timings = [timing[index] for timing in timings]
+        print(f"{stage:14} median {statistics.median(stage_timings):7.1f} ms   min {min(stage_timings):7.1f} ms")
+    totals = [sum(timing) for timing in timings]
+    print(f"{'total':14} median {statistics.median(totals):7.1f} ms   min {min(totals):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
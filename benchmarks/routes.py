@@ -0,0 +1,212 @@
+# Drives the main routes of the shop through the Flask test client against a synthetic dataset, and reports the
+# median and 99th percentile latency and the queries run per request of each. Run from the repository root:
+#
+#     python -m benchmarks.routes [--items 1k] [--requests 200] [--database PATH] [--save]
+#
+# The dataset is made by seed_database() with a fixed seed, in a temporary database unless --database names a file,
+# which is seeded the first time and reused afterwards so large scales are only generated once. --save writes the
+# results to benchmarks/baselines/routes-<items>.json, and every run prints how it compares with that file, so a
+# change that adds queries or slows a route shows up as a diff of the baseline
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import main2
+from synthetic import PASSWORD, COLORS, NOUNS, TYPES, parse_scale
+
+BASELINE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Image of the added and edited items. Its variants are made off the request, and not at all here since the
+# benchmark runs with IMAGE_WORKERS set to 0
+ITEM_IMAGE = "https://picsum.photos/seed/benchmark/640/800"
+
+# Unmeasured requests made to each route first, so the numbers describe a warmed up worker rather than its caches
+# and connection pool filling up
+WARMUP_REQUESTS = 5
+
+# Login runs the full password hash on every request, so it gets fewer requests than the other routes
+LOGIN_REQUESTS = 20
+
+
+def item_form(name, price):
+    return {"name": name, "img_url": ITEM_IMAGE, "price": f"{price:.2f}", "sex": "Unisex", "size": "Medium",
+            "brand": "Benchmark", "type": "Tops", "weight": "0.3", "color": "Black"}
+
+
+class Shop:
+    # The app, a test client per role and the ids the scenarios pick from
+
+    def __init__(self, app, items, seed):
+        self.app = app
+        self.items = items
+        self.rng = random.Random(seed)
+        self.added_item_ids = []
+        with app.app_context():
+            self.owner = main2.User.query.filter_by(type="Owner").order_by(main2.User.id).first()
+            # The customer with the largest open order, so view_order has something to show
+            open_order = main2.db.session.query(main2.Order) \
+                .join(main2.PlacedIn, main2.PlacedIn.order_num == main2.Order.order_num) \
+                .filter(main2.Order.status == "open").group_by(main2.Order.order_num) \
+                .order_by(main2.db.func.count().desc(), main2.Order.order_num).first()
+            self.customer = main2.db.session.get(main2.User, open_order.user_id)
+            self.owner_id, self.customer_id = self.owner.id, self.customer.id
+            self.customer_email = self.customer.email_address
+        self.anonymous = app.test_client()
+        self.owner_client = self.client(self.owner_id)
+        self.customer_client = self.client(self.customer_id)
+
+    def client(self, user_id):
+        # A client logged in as the user through the session cookie, without going through the login route
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+            session["_fresh"] = True
+        return client
+
+    def item_id(self):
+        return self.rng.randint(1, self.items)
+
+    def catalog_query(self):
+        # Filters and a price floor picked at random, so most requests miss the page cache
+        return f"type={self.rng.choice(TYPES)[0]}&color={self.rng.choice(COLORS)}&sort=price" \
+               f"&min_price={self.rng.randint(5, 150)}"
+
+    def search_term(self):
+        return self.rng.choice([noun.split()[-1].lower() for nouns in NOUNS.values() for noun in nouns] + list(COLORS))
+
+
+# (name, requests, function making one request). Owner scenarios run in this order, so edit and delete work on the
+# items added by owner_add_item rather than the generated catalog
+SCENARIOS = [
+    ("home (anonymous)", None, lambda shop: shop.anonymous.get("/")),
+    ("home (filtered)", None, lambda shop: shop.anonymous.get(f"/?{shop.catalog_query()}")),
+    ("home (customer)", None, lambda shop: shop.customer_client.get("/")),
+    ("items json", None, lambda shop: shop.anonymous.get(f"/items?{shop.catalog_query()}")),
+    ("search", None, lambda shop: shop.anonymous.get(f"/search?q={shop.search_term()}")),
+    ("login", LOGIN_REQUESTS, lambda shop: shop.app.test_client().post(
+        "/login", data={"email": shop.customer_email, "password": PASSWORD})),
+    ("customer_add_item GET", None, lambda shop: shop.customer_client.get(f"/customer-add-item/{shop.item_id()}")),
+    ("customer_add_item POST", None, lambda shop: shop.customer_client.post(f"/customer-add-item/{shop.item_id()}",
+                                                                            data=item_form("x", 1))),
+    ("view_order", None, lambda shop: shop.customer_client.get("/view-order")),
+    ("owner_add_item", None, lambda shop: add_item(shop)),
+    ("edit_item", None, lambda shop: shop.owner_client.post(
+        f"/edit-item/{shop.rng.choice(shop.added_item_ids)}",
+        data=item_form(f"Edited {shop.rng.randrange(10 ** 9)}", shop.rng.uniform(5, 200)))),
+    ("delete_item", None, lambda shop: shop.owner_client.get(f"/delete-item/{shop.added_item_ids.pop()}")),
+]
+
+
+def add_item(shop):
+    name = f"Benchmark item {len(shop.added_item_ids)}"
+    response = shop.owner_client.post("/owner-add-item", data=item_form(name, shop.rng.uniform(5, 200)))
+    with shop.app.app_context():
+        shop.added_item_ids.append(main2.Item.query.filter_by(name=name).one().id)
+    return response
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def run(shop, requests):
+    # Latency in milliseconds and queries of every request of every scenario, including reading a streamed body
+    queries = []
+    main2.instrumentation.subscribe(lambda endpoint, method, status, timing: queries.append(timing.queries))
+    results = {}
+    for name, scenario_requests, scenario in SCENARIOS:
+        latencies, counts, statuses = [], [], set()
+        for index in range(WARMUP_REQUESTS + (scenario_requests or requests)):
+            started = time.perf_counter()
+            response = scenario(shop)
+            response.get_data()
+            response.close()
+            elapsed = (time.perf_counter() - started) * 1000
+            # Instrumentation hands over the timing when the response is closed
+            query_count = queries.pop()
+            if index >= WARMUP_REQUESTS:
+                latencies.append(elapsed)
+                counts.append(query_count)
+                statuses.add(response.status_code)
+        results[name] = {
+            "requests": len(latencies),
+            "statuses": sorted(statuses),
+            "p50_ms": round(percentile(latencies, 0.5), 2),
+            "p99_ms": round(percentile(latencies, 0.99), 2),
+            "queries_per_request": round(sum(counts) / len(counts), 2),
+            "max_queries": max(counts),
+        }
+    return results
+
+
+def change(new, old):
+    if not old:
+        return ""
+    return f"{(new - old) / old * 100:+.0f}%"
+
+
+def report(results, baseline):
+    print(f"{'route':24} {'requests':>8} {'p50 ms':>8} {'':>6} {'p99 ms':>8} {'':>6} {'queries':>8} {'':>6} status")
+    for name, result in results.items():
+        old = baseline.get(name, {})
+        print(f"{name:24} {result['requests']:8}"
+              f" {result['p50_ms']:8.2f} {change(result['p50_ms'], old.get('p50_ms')):>6}"
+              f" {result['p99_ms']:8.2f} {change(result['p99_ms'], old.get('p99_ms')):>6}"
+              f" {result['queries_per_request']:8.2f}"
+              f" {change(result['queries_per_request'], old.get('queries_per_request')):>6}"
+              f" {','.join(map(str, result['statuses']))}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", default="1k", help="dataset size, e.g. 1k, 100k, 1m or a number")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", help="SQLite file to seed once and reuse")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline of this dataset size")
+    args = parser.parse_args()
+    items = parse_scale(args.items)
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.database or os.path.join(directory, "bench.db")
+        seeded = os.path.exists(path)
+        app = main2.create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.abspath(path)}",
+            "SECRET_KEY": "benchmark",
+            "WTF_CSRF_ENABLED": False,
+            "METRICS_FOLDER": os.path.join(directory, "metrics"),
+            "IMAGE_VARIANT_FOLDER": os.path.join(directory, "images"),
+            "CATALOG_VERSION_FILE": os.path.join(directory, "catalog_version"),
+            "IMAGE_WORKERS": 0,
+        })
+        # Keep the per-request log lines and query budget warnings out of the report
+        app.logger.setLevel(logging.ERROR)
+        logging.getLogger("main2.requests").setLevel(logging.ERROR)
+        with app.app_context():
+            main2.create_schema()
+            if not seeded:
+                started = time.perf_counter()
+                main2.seed_database(items, args.seed)
+                print(f"Seeded {items:,} items in {time.perf_counter() - started:.1f}s")
+            items = main2.db.session.query(main2.db.func.max(main2.Item.id)).scalar()
+        results = run(Shop(app, items, args.seed), args.requests)
+    baseline_path = os.path.join(BASELINE_FOLDER, f"routes-{args.items.lower()}.json")
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+    report(results, baseline)
+    if args.save:
+        os.makedirs(BASELINE_FOLDER, exist_ok=True)
+        with open(baseline_path, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=1, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"Saved {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
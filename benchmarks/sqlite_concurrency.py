@@ -0,0 +1,136 @@
+# Compares SQLite's default rollback journal with the production profile in database.py while one thread writes and
+# several threads read the catalog at the same time. Run from the repository root:
+#
+#     python -m benchmarks.sqlite_concurrency [--readers 8] [--seconds 5]
+#
+# With the default journal a writer locks the whole file while it commits, so readers wait or fail with "database is
+# locked". In WAL mode readers keep reading the last committed version and are not held up by the writer.
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from database import engine_options, apply_sqlite_pragmas
+
+ITEMS = 20000
+
+# Settings of each profile, as configure_database() would set them
+PROFILES = {
+    # What the app used before: rollback journal, full syncs and no busy timeout
+    "default": {
+        "SQLITE_JOURNAL_MODE": "DELETE",
+        "SQLITE_SYNCHRONOUS": "FULL",
+        "SQLITE_CACHE_SIZE_KB": 2000,
+        "SQLITE_MMAP_SIZE": 0,
+        "SQLITE_BUSY_TIMEOUT_MS": 0,
+        "DATABASE_POOL_SIZE": 10,
+        "DATABASE_MAX_OVERFLOW": 20,
+    },
+    "production": {
+        "SQLITE_JOURNAL_MODE": "WAL",
+        "SQLITE_SYNCHRONOUS": "NORMAL",
+        "SQLITE_CACHE_SIZE_KB": 64 * 1024,
+        "SQLITE_MMAP_SIZE": 256 * 1024 * 1024,
+        "SQLITE_BUSY_TIMEOUT_MS": 5000,
+        "DATABASE_POOL_SIZE": 10,
+        "DATABASE_MAX_OVERFLOW": 20,
+    },
+}
+
+# One page of the catalog, as the home page reads it
+READ_QUERY = text("SELECT id, name, price FROM item WHERE type = :type ORDER BY price, id LIMIT 24")
+
+
+def make_engine(path, profile):
+    config = dict(PROFILES[profile], SQLALCHEMY_DATABASE_URI=f"sqlite:///{path}")
+    engine = create_engine(config['SQLALCHEMY_DATABASE_URI'], **engine_options(config))
+    apply_sqlite_pragmas(engine, config)
+    return engine
+
+
+def fill(engine):
+    # A table shaped like the item table with its catalog index, and ITEMS rows
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT, type TEXT, price FLOAT)"))
+        connection.execute(text("CREATE INDEX ix_item_type_price_id ON item (type, price, id)"))
+        connection.execute(text("INSERT INTO item (name, type, price) VALUES (:name, :type, :price)"),
+                           [{"name": f"Item {i}", "type": ("shirt", "pants", "shoes")[i % 3], "price": i % 500}
+                            for i in range(ITEMS)])
+
+
+def reader(engine, stop, latencies, errors):
+    # Read catalog pages until told to stop, recording each read's latency in milliseconds
+    types = ("shirt", "pants", "shoes")
+    n = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            with engine.connect() as connection:
+                connection.execute(READ_QUERY, {"type": types[n % 3]}).fetchall()
+        except OperationalError:
+            errors.append(1)
+            continue
+        finally:
+            n += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def writer(engine, stop, commits, errors):
+    # Reprice a batch of items per transaction until told to stop, like an owner editing the catalog
+    n = 0
+    while not stop.is_set():
+        try:
+            with engine.begin() as connection:
+                connection.execute(text("UPDATE item SET price = price + 1 WHERE id % 100 = :n"), {"n": n % 100})
+            commits.append(1)
+        except OperationalError:
+            errors.append(1)
+        n += 1
+
+
+def run(profile, readers, seconds):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "bench.db")
+    engine = make_engine(path, profile)
+    fill(engine)
+    stop = threading.Event()
+    latencies, read_errors, commits, write_errors = [], [], [], []
+    threads = [threading.Thread(target=reader, args=(engine, stop, latencies, read_errors)) for _ in range(readers)]
+    threads.append(threading.Thread(target=writer, args=(engine, stop, commits, write_errors)))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+    latencies.sort()
+    return {
+        "reads/s": len(latencies) / seconds,
+        "read p50 ms": statistics.median(latencies) if latencies else 0,
+        "read p99 ms": latencies[int(len(latencies) * 0.99)] if latencies else 0,
+        "read errors": len(read_errors),
+        "commits/s": len(commits) / seconds,
+        "write errors": len(write_errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=8, help="reader threads")
+    parser.add_argument("--seconds", type=float, default=5, help="how long each profile runs")
+    args = parser.parse_args()
+    results = {profile: run(profile, args.readers, args.seconds) for profile in PROFILES}
+    print(f"{'':14}" + "".join(f"{profile:>14}" for profile in results))
+    for metric in results["default"]:
+        print(f"{metric:14}" + "".join(f"{result[metric]:14.1f}" for result in results.values()))
+
+
+if __name__ == "__main__":
+    main()
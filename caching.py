@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Returned by LRUCache.get when a key is missing or expired, so None can be cached like any other value
+MISSING = object()
+
+
+class LRUCache:
+    # Thread-safe in-process cache that evicts the least recently used entries once it holds max_entries, or once
+    # the sizes given to set() add up to more than max_bytes, and optionally treats entries older than ttl seconds
+    # as missing
+
+    def __init__(self, max_entries=1024, ttl=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        # Counters for hit ratios
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, max_entries=1024, ttl=None, max_bytes=None):
+        # Change the limits of a cache created before its app was configured, evicting entries over the new limits
+        with self.lock:
+            self.max_entries = max_entries
+            self.ttl = ttl
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, key):
+        # Value stored under key, or MISSING. A hit makes the entry the most recently used
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (self.ttl is not None and time.monotonic() - entry[1] > self.ttl):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size=0):
+        # Store value under key, evicting the least recently used entries if the cache is full.
+        # size is the memory the value takes up, counted against max_bytes
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (value, time.monotonic(), size)
+            self.total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        # Drop the least recently used entries until the cache is within its limits, the lock must be held
+        while len(self.entries) > self.max_entries or \
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        # Drop an entry and its size, the lock must be held
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def invalidate(self, key):
+        # Drop a single entry
+        with self.lock:
+            self._remove(key)
+
+    def clear(self):
+        # Drop every entry
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        # Size and hit/miss counts of the cache
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.total_bytes, "hits": self.hits, "misses": self.misses}
+
+
+class VersionCounter:
+    # Version number shared by every worker process through a small file: bumping replaces the file, and reading
+    # the version is a single stat() call, so checking it never touches the database
+
+    def __init__(self, path=None):
+        self.path = None
+        if path is not None:
+            self.open(path)
+
+    def open(self, path):
+        # Use the version file at path, creating it if it doesn't exist yet
+        self.path = path
+        if not os.path.exists(path):
+            self.bump()
+
+    def bump(self):
+        # Write a new file and move it into place, which gives the version file a new inode and modification time
+        temporary_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w") as version_file:
+            version_file.write(str(time.time_ns()))
+        os.replace(temporary_path, self.path)
+
+    def current(self):
+        # Current version as a string, changing every time bump() is called in any process
+        stat = os.stat(self.path)
+        return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}"
+
+    def last_modified(self):
+        # Time of the last bump, as a timezone-aware UTC datetime for Last-Modified headers
+        return datetime.fromtimestamp(int(os.stat(self.path).st_mtime), tz=timezone.utc)
@@ -0,0 +1,110 @@
+import os
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Bind key of the engine that routes marked read_only query
+READ_BIND = "read"
+
+
+def configure_database(app):
+    # Database settings, each of which can be overridden from the environment. Call before SQLAlchemy(app)
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', os.environ.get("DATABASE_URL", "sqlite:///clothing3.db"))
+    # WAL lets readers keep reading while a writer commits, and NORMAL only syncs at checkpoints, which is safe
+    # in WAL mode
+    app.config.setdefault('SQLITE_JOURNAL_MODE', os.environ.get("SQLITE_JOURNAL_MODE", "WAL"))
+    app.config.setdefault('SQLITE_SYNCHRONOUS', os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"))
+    # Page cache per connection and memory-mapped I/O size
+    app.config.setdefault('SQLITE_CACHE_SIZE_KB', int(os.environ.get("SQLITE_CACHE_SIZE_KB", 64 * 1024)))
+    app.config.setdefault('SQLITE_MMAP_SIZE', int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)))
+    # How long a connection waits for a lock held by another one before failing with "database is locked"
+    app.config.setdefault('SQLITE_BUSY_TIMEOUT_MS', int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)))
+    # Connections kept open per worker process, and how many more may be opened under load
+    app.config.setdefault('DATABASE_POOL_SIZE', int(os.environ.get("DATABASE_POOL_SIZE", 10)))
+    app.config.setdefault('DATABASE_MAX_OVERFLOW', int(os.environ.get("DATABASE_MAX_OVERFLOW", 20)))
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    # Where read-only routes send their queries: a replica when DATABASE_READ_URL is set, otherwise the primary
+    # SQLite file opened with mode=ro. Without either, read-only routes use the primary like every other route
+    app.config.setdefault('DATABASE_READ_URL',
+                          os.environ.get("DATABASE_READ_URL") or read_only_url(app.config['SQLALCHEMY_DATABASE_URI']))
+    if app.config['DATABASE_READ_URL']:
+        app.config.setdefault('SQLALCHEMY_BINDS', {})
+        app.config['SQLALCHEMY_BINDS'].setdefault(READ_BIND, {"url": app.config['DATABASE_READ_URL'],
+                                                              **engine_options(app.config)})
+
+
+def engine_options(config):
+    # create_engine() options for the configured database
+    options = {
+        "pool_size": config['DATABASE_POOL_SIZE'],
+        "max_overflow": config['DATABASE_MAX_OVERFLOW'],
+    }
+    if make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name() == "sqlite":
+        options["connect_args"] = {
+            # Connections are handed between the threads of a multi-threaded worker by the pool
+            "check_same_thread": False,
+            "timeout": config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+        }
+    return options
+
+
+def read_only_url(uri):
+    # The same SQLite file opened read-only, as a URI filename: sqlite:///file:clothing3.db?mode=ro&uri=true.
+    # None for other databases and in-memory SQLite, which can't be opened twice
+    url = make_url(uri)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    database = url.database if url.query.get("uri") else f"file:{url.database}"
+    return url.set(database=database).update_query_dict({"mode": "ro", "uri": "true"}).render_as_string()
+
+
+def sqlite_pragmas(config, read_only=False):
+    # PRAGMA statements run on every new SQLite connection. The journal mode and syncing belong to whoever writes
+    # the file, and a read-only connection refuses to run any statement that would write
+    if read_only:
+        return [
+            f"PRAGMA cache_size=-{config['SQLITE_CACHE_SIZE_KB']}",
+            f"PRAGMA mmap_size={config['SQLITE_MMAP_SIZE']}",
+            f"PRAGMA busy_timeout={config['SQLITE_BUSY_TIMEOUT_MS']}",
+            "PRAGMA temp_store=MEMORY",
+            "PRAGMA query_only=ON",
+        ]
+    return [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        # A negative cache_size is in KiB rather than pages
+        f"PRAGMA cache_size=-{config['SQLITE_CACHE_SIZE_KB']}",
+        f"PRAGMA mmap_size={config['SQLITE_MMAP_SIZE']}",
+        f"PRAGMA busy_timeout={config['SQLITE_BUSY_TIMEOUT_MS']}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def apply_sqlite_pragmas(engine, config, read_only=False):
+    # Run the pragmas on every connection the engine opens. Call before the engine is first used
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = sqlite_pragmas(config, read_only)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def use_read_only_database():
+    # Send the rest of this request's queries to the read-only engine
+    g.read_only_database = True
+
+
+class RoutingSession(Session):
+    # Session that sends every query of a read-only request to the read-only engine, and everything else to the
+    # engine of the model's bind key as usual. Pass as SQLAlchemy(session_options={"class_": RoutingSession})
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get("read_only_database") and READ_BIND in self._db.engines:
+            return self._db.engines[READ_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
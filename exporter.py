@@ -0,0 +1,43 @@
+import csv
+import io
+import json
+
+# Encoded rows are collected into chunks of about this many characters before being handed on, so a large
+# export is written in a few big pieces rather than one tiny piece per row
+CHUNK_SIZE = 64 * 1024
+
+
+def encode_csv(columns, rows):
+    # Yield a CSV file with a header row, chunk by chunk, while the rows are still being read
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def encode_jsonl(columns, rows):
+    # Yield a JSON Lines file, one object per row, chunk by chunk while the rows are still being read
+    chunk = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, row)), separators=(",", ":")) + "\n"
+        chunk.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+    yield "".join(chunk)
+
+
+# Encoder and content type of each export format
+EXPORT_FORMATS = {
+    "csv": (encode_csv, "text/csv"),
+    "jsonl": (encode_jsonl, "application/x-ndjson"),
+}
@@ -1,7 +1,25 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, PasswordField, DateTimeField, SelectField, SelectMultipleField
-from wtforms.validators import DataRequired, Email, EqualTo, URL
+from wtforms.validators import DataRequired, Email, EqualTo, URL, ValidationError
 import datetime
+import math
+
+
+class FiniteNumber:
+    # Accepts text that reads as an ordinary number, so a price or weight like "abc" or "inf" shows an error on the
+    # form instead of failing when it is used. Empty fields are left to DataRequired
+    def __init__(self, message="Must be a number."):
+        self.message = message
+
+    def __call__(self, form, field):
+        if not field.data:
+            return
+        try:
+            value = float(field.data)
+        except (TypeError, ValueError):
+            raise ValidationError(self.message)
+        if not math.isfinite(value):
+            raise ValidationError(self.message)
 
 
 class SignUpForm(FlaskForm):
@@ -27,13 +45,13 @@ class LoginForm(FlaskForm):
 class ItemForm(FlaskForm):
     name = StringField("Name", validators=[DataRequired()])
     img_url = StringField(label="Image Link", validators=[DataRequired(), URL()])
-    price = StringField("Price", default="0.00", validators=[DataRequired()])
+    price = StringField("Price", default="0.00", validators=[DataRequired(), FiniteNumber()])
     sex = SelectField(label="Sex", choices=['Unisex', 'Male', 'Female'], validators=[DataRequired()])
     size = SelectField(label="Size", choices=['Small', 'Medium', 'Large'], validators=[DataRequired()])
     brand = StringField("Brand")
     # type = StringField(label="Type (eg. Tops, Bottoms, Accessories, Footwear)", validators=[DataRequired()])
     type = SelectField(label="Type", choices=['Tops', 'Bottoms', 'Accessories', 'Footwear'], validators=[DataRequired()])
-    weight = StringField("Weight")
+    weight = StringField("Weight", validators=[FiniteNumber()])
     # colors = SelectMultipleField(label="Colors", choices=['Black', 'White', 'Brown', 'Grey', 'Blue', 'Red',
     #                                                       'Green', 'Pink', 'Purple', 'Yellow', 'Orange'])
     color = StringField("Color")
@@ -43,13 +61,13 @@ class ItemForm(FlaskForm):
 class ItemForm(FlaskForm):
     name = StringField("Name", validators=[DataRequired()])
     img_url = StringField(label="Image Link", validators=[DataRequired(), URL()])
-    price = StringField("Price", default="0.00", validators=[DataRequired()])
+    price = StringField("Price", default="0.00", validators=[DataRequired(), FiniteNumber()])
     sex = SelectField(label="Sex", choices=['Unisex', 'Male', 'Female'], validators=[DataRequired()])
     size = SelectField(label="Size", choices=['Small', 'Medium', 'Large'], validators=[DataRequired()])
     brand = StringField("Brand")
     # type = StringField(label="Type (eg. Tops, Bottoms, Accessories, Footwear)", validators=[DataRequired()])
     type = SelectField(label="Type", choices=['Tops', 'Bottoms', 'Accessories', 'Footwear'], validators=[DataRequired()])
-    weight = StringField("Weight")
+    weight = StringField("Weight", validators=[FiniteNumber()])
     # colors = SelectMultipleField(label="Colors", choices=['Black', 'White', 'Brown', 'Grey', 'Blue', 'Red',
     #                                                       'Green', 'Pink', 'Purple', 'Yellow', 'Orange'])
     color = StringField("Color")
@@ -58,13 +76,13 @@ class ItemForm(FlaskForm):
 class ItemForm(FlaskForm):
     name = StringField("Name", validators=[DataRequired()])
     img_url = StringField(label="Image Link", validators=[DataRequired(), URL()])
-    price = StringField("Price", default="0.00", validators=[DataRequired()])
+    price = StringField("Price", default="0.00", validators=[DataRequired(), FiniteNumber()])
     sex = SelectField(label="Sex", choices=['Unisex', 'Male', 'Female'], validators=[DataRequired()])
     size = SelectField(label="Size", choices=['Small', 'Medium', 'Large'], validators=[DataRequired()])
     brand = StringField("Brand")
     # type = StringField(label="Type (eg. Tops, Bottoms, Accessories, Footwear)", validators=[DataRequired()])
     type = SelectField(label="Type", choices=['Tops', 'Bottoms', 'Accessories', 'Footwear'], validators=[DataRequired()])
-    weight = StringField("Weight")
+    weight = StringField("Weight", validators=[FiniteNumber()])
     # colors = SelectMultipleField(label="Colors", choices=['Black', 'White', 'Brown', 'Grey', 'Blue', 'Red',
     #                                                       'Green', 'Pink', 'Purple', 'Yellow', 'Orange'])
     color = StringField("Color")
@@ -0,0 +1,286 @@
+import atexit
+import hashlib
+import http.client
+import io
+import ipaddress
+import json
+import os
+import re
+import socket
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, send_from_directory, url_for, abort
+from assets import IMMUTABLE
+
+# Pillow is optional: without it no variants are made and templates link the original images
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Widths of the variants made of every image. Widths larger than the original are skipped, and the original width
+# is added when it falls between two of these
+VARIANT_WIDTHS = (320, 640, 960, 1280, 1920)
+# Width of the variant used as src by browsers that don't understand srcset
+FALLBACK_WIDTH = 640
+# Format, file extension and encoder settings of each variant
+VARIANT_FORMATS = (
+    ("WEBP", "webp", {"quality": 80, "method": 4}),
+    ("JPEG", "jpg", {"quality": 82, "optimize": True, "progressive": True}),
+)
+# Name of a variant file: <key>-<width>.<extension>
+VARIANT_NAME = re.compile(r"[0-9a-f]{16}-\d+\.(webp|jpg)")
+
+
+class ImageError(Exception):
+    # Raised when an image can't be fetched or decoded
+    pass
+
+
+# Schemes of the image URLs that are fetched, also after a redirect
+FETCH_SCHEMES = ("http", "https")
+# Redirects followed before a download is given up
+MAX_REDIRECTS = 3
+
+
+def connect_to_public_host(address, timeout, source_address=None):
+    # Open a connection like socket.create_connection, but only to a host whose every address is on the public
+    # internet. Owners type in the URLs, so without this they could make the server read its own loopback services,
+    # the private network or a cloud metadata address. The connection goes to an address checked here rather than
+    # the host name, so a DNS answer changing between the check and the connection can't get around it
+    host, port = address
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    except socket.gaierror as error:
+        raise ImageError(f"Could not resolve {host}: {error}")
+    for ip in addresses:
+        if not ipaddress.ip_address(ip).is_global:
+            raise ImageError(f"{host} is not a public address.")
+    return socket.create_connection((addresses[0], port), timeout, source_address)
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, request):
+        return self.do_open(self.connection, request)
+
+    @staticmethod
+    def connection(host, **options):
+        connection = http.client.HTTPConnection(host, **options)
+        connection._create_connection = connect_to_public_host
+        return connection
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, request):
+        return self.do_open(self.connection, request, context=self._context)
+
+    @staticmethod
+    def connection(host, **options):
+        connection = http.client.HTTPSConnection(host, **options)
+        connection._create_connection = connect_to_public_host
+        return connection
+
+
+class CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # Follows a few redirects, each to an http or https URL that goes through the checks of the first one
+    max_redirections = MAX_REDIRECTS
+
+    def redirect_request(self, request, fp, code, msg, headers, new_url):
+        check_fetch_url(new_url)
+        return super().redirect_request(request, fp, code, msg, headers, new_url)
+
+
+def check_fetch_url(url):
+    # Refuse URLs that aren't http or https before anything is sent
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in FETCH_SCHEMES or not parts.hostname:
+        raise ImageError("Only http and https URLs can be fetched.")
+
+
+def image_opener():
+    # urllib opener that only speaks http and https to public hosts and ignores proxy settings. Unlike
+    # build_opener() it leaves out the file, ftp and data handlers
+    opener = urllib.request.OpenerDirector()
+    for handler in (PublicHTTPHandler(), PublicHTTPSHandler(), CheckedRedirectHandler(),
+                    urllib.request.HTTPDefaultErrorHandler(), urllib.request.HTTPErrorProcessor()):
+        opener.add_handler(handler)
+    return opener
+
+
+class ImageVariants:
+    # Makes resized, recompressed WebP and JPEG variants of images and caches them on disk under names derived from
+    # the content of the original, so the same image is only ever processed once and every variant can be cached
+    # forever. Follows the init_app pattern of the other extensions
+
+    def __init__(self, app=None):
+        self.metadata = {}
+        self.static_keys = {}
+        self.executor = None
+        self.opener = image_opener()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Folder of the variants, and limits on the images fetched from the URLs owners paste into the item form
+        app.config.setdefault('IMAGE_VARIANT_FOLDER', os.path.join(app.instance_path, "images"))
+        app.config.setdefault('IMAGE_FETCH_TIMEOUT', 10)
+        app.config.setdefault('IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+        # Threads making the variants of new item images after the request that added them. With 0 nothing is made
+        # on upload and flask build-images picks the images up instead
+        app.config.setdefault('IMAGE_WORKERS', int(os.environ.get("IMAGE_WORKERS", 2)))
+        self.folder = app.config['IMAGE_VARIANT_FOLDER']
+        self.workers = app.config['IMAGE_WORKERS']
+        # One pool for the process, however many apps are set up
+        if self.workers and self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-variants")
+            atexit.register(self.executor.shutdown, wait=False)
+        self.static_manifest_path = os.path.join(self.folder, "static.json")
+        if os.path.exists(self.static_manifest_path):
+            with open(self.static_manifest_path) as manifest_file:
+                self.static_keys = json.load(manifest_file)
+        app.add_url_rule("/images/<name>", "image_variant", self.send)
+        app.add_template_global(self.variants, "image_variants")
+        app.add_template_global(self.srcset, "image_srcset")
+        app.add_template_global(self.fallback_url, "image_url")
+        app.add_template_global(self.static_key, "static_image_key")
+        app.extensions['image_variants'] = self
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def process(self, content):
+        # Make the variants of an image given as bytes, unless they exist already, and return its key
+        key = hashlib.sha256(content).hexdigest()[:16]
+        if os.path.exists(os.path.join(self.folder, f"{key}.json")):
+            return key
+        try:
+            image = Image.open(io.BytesIO(content))
+            # Let the JPEG decoder scale a photo straight from the camera down to about the largest variant, which
+            # is many times faster than decoding it at full size
+            image.draft("RGB", (VARIANT_WIDTHS[-1], VARIANT_WIDTHS[-1]))
+            # Apply the camera's rotation, which the variants would otherwise lose along with the EXIF data
+            image = ImageOps.exif_transpose(image).convert("RGB")
+        except (OSError, Image.DecompressionBombError) as error:
+            raise ImageError(f"Not an image: {error}")
+        widths = sorted({width for width in VARIANT_WIDTHS if width < image.width} |
+                        {min(image.width, VARIANT_WIDTHS[-1])})
+        height = round(image.height * widths[-1] / image.width)
+        os.makedirs(self.folder, exist_ok=True)
+        # Largest first, each variant resized from the one before it rather than from the original
+        resized = image
+        for width in reversed(widths):
+            resized = resized.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+            for image_format, extension, options in VARIANT_FORMATS:
+                self.write(f"{key}-{width}.{extension}",
+                           lambda file: resized.save(file, image_format, **options))
+        # Written last, so an image counts as processed only once all of its variants exist
+        metadata = {"key": key, "width": widths[-1], "height": height, "widths": widths}
+        self.write(f"{key}.json", lambda file: file.write(json.dumps(metadata).encode()))
+        return key
+
+    def write(self, name, save):
+        # Write a file through a temporary one, so other workers never serve a half-written variant
+        path = os.path.join(self.folder, name)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            save(file)
+        os.replace(temporary_path, path)
+
+    def fetch(self, url):
+        # Download an image from a public http or https server, giving up on slow servers and files larger than
+        # IMAGE_MAX_BYTES
+        check_fetch_url(url)
+        max_bytes = current_app.config['IMAGE_MAX_BYTES']
+        try:
+            with self.opener.open(url, timeout=current_app.config['IMAGE_FETCH_TIMEOUT']) as response:
+                content = response.read(max_bytes + 1)
+        except (OSError, ValueError) as error:
+            raise ImageError(f"Could not fetch {url}: {error}")
+        if len(content) > max_bytes:
+            raise ImageError(f"{url} is larger than {max_bytes} bytes.")
+        return content
+
+    def process_url(self, url):
+        # Key of the image at url, or None when Pillow isn't installed or the image can't be processed, in which
+        # case pages keep linking the original URL
+        if not self.enabled or not url:
+            return None
+        try:
+            return self.process(self.fetch(url))
+        except ImageError as error:
+            current_app.logger.warning("No variants for %s: %s", url, error)
+            return None
+
+    def process_later(self, url, callback):
+        # Make the variants of the image at url on a worker thread, so the request adding it doesn't wait for the
+        # download and the resizing, then call callback(key) inside an app context. Does nothing when Pillow isn't
+        # installed or IMAGE_WORKERS is 0
+        if not self.enabled or not url or not self.workers:
+            return None
+        return self.executor.submit(self._process_in_background, current_app._get_current_object(), url, callback)
+
+    def _process_in_background(self, app, url, callback):
+        with app.app_context():
+            try:
+                key = self.process_url(url)
+                if key is not None:
+                    callback(key)
+            except Exception:
+                # Nobody waits for the result, so the error would otherwise go unnoticed
+                app.logger.exception("Making the variants of %s failed", url)
+
+    def build_static(self, static_folder, folders):
+        # Make the variants of every image in the given folders of the static folder, and record which key each
+        # file has so templates can find them with static_image_key(). Returns {path: key}
+        for folder in folders:
+            for directory, _, filenames in os.walk(os.path.join(static_folder, folder)):
+                for filename in sorted(filenames):
+                    path = os.path.join(directory, filename)
+                    with open(path, "rb") as image_file:
+                        content = image_file.read()
+                    try:
+                        key = self.process(content)
+                    except ImageError:
+                        continue
+                    self.static_keys[os.path.relpath(path, static_folder).replace(os.sep, "/")] = key
+        self.write("static.json", lambda file: file.write(json.dumps(self.static_keys, indent=1).encode()))
+        return self.static_keys
+
+    def static_key(self, filename):
+        # Key of an image of the static folder processed by build_static(), or None
+        return self.static_keys.get(filename)
+
+    def variants(self, key):
+        # Size and variant widths of a processed image, or None if it hasn't been processed. Kept in memory once
+        # read, since the variants of a key never change
+        if not key:
+            return None
+        if key not in self.metadata:
+            path = os.path.join(self.folder, f"{key}.json")
+            if not os.path.exists(path):
+                return None
+            with open(path) as metadata_file:
+                self.metadata[key] = json.load(metadata_file)
+        return self.metadata[key]
+
+    def srcset(self, variants, extension):
+        # srcset attribute listing every width of one format
+        key = variants["key"]
+        return ", ".join(f"{url_for('image_variant', name=f'{key}-{width}.{extension}')} {width}w"
+                         for width in variants["widths"])
+
+    def fallback_url(self, variants, extension="jpg"):
+        # URL of the variant closest to FALLBACK_WIDTH, for the src attribute
+        width = min(variants["widths"], key=lambda width: abs(width - FALLBACK_WIDTH))
+        key = variants["key"]
+        return url_for("image_variant", name=f"{key}-{width}.{extension}")
+
+    def send(self, name):
+        # Serve a variant. Its name changes whenever the original does, so it can be cached forever
+        if not VARIANT_NAME.fullmatch(name):
+            return abort(404)
+        response = send_from_directory(self.folder, name)
+        response.headers["Cache-Control"] = IMMUTABLE
+        return response
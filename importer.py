@@ -0,0 +1,59 @@
+import csv
+import json
+import math
+from werkzeug.datastructures import MultiDict
+from forms import ItemForm
+
+# Fields of an item that can be imported, named as in ItemForm and the item table
+ITEM_COLUMNS = ("name", "img_url", "price", "sex", "size", "brand", "type", "weight", "color")
+
+
+def read_rows(file, file_format):
+    # Yield (line number, row) from a CSV file with a header row or a JSON Lines file, one row at a time so files of
+    # any size can be imported. Lines of a JSON Lines file that aren't valid JSON are yielded as None
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, None
+
+
+class ItemRowValidator:
+    # Checks imported rows with the same rules as the item form owners fill in. A single form is reused for every
+    # row, which is several times faster than building a new form per row
+
+    def __init__(self):
+        self.form = ItemForm(formdata=None, meta={"csrf": False})
+
+    def validate(self, row):
+        # Return (values, None) for a valid row, ready to be written to the item table, or (None, errors)
+        if not isinstance(row, dict):
+            return None, {"row": ["Not a JSON object."]}
+        self.form.process(MultiDict({column: "" if row.get(column) is None else str(row.get(column))
+                                     for column in ITEM_COLUMNS}))
+        if not self.form.validate():
+            return None, self.form.errors
+        # Empty optional fields are stored as NULL, like the columns of items that never had a value
+        values = {column: self.form[column].data or None for column in ITEM_COLUMNS}
+        # The form takes price and weight as text, but the item table stores them as numbers. float() also reads
+        # "inf" and "nan", which would sort and add up wrongly in the catalog and order totals
+        errors = {}
+        for column in ("price", "weight"):
+            if values[column] is None:
+                continue
+            try:
+                values[column] = float(values[column])
+            except ValueError:
+                values[column] = math.nan
+            if not math.isfinite(values[column]):
+                errors[column] = ["Must be a number."]
+        if errors:
+            return None, errors
+        return values, None
@@ -0,0 +1,149 @@
+import json
+import logging
+import time
+from collections import Counter
+from flask import current_app, g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+
+# Longest part of a statement kept for the log line
+STATEMENT_LENGTH = 300
+
+
+class RequestTiming:
+    # What one request spent its time on
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()
+        self.render_time = 0.0
+        # Start times of the templates being rendered, innermost last. Templates rendered inside another one, like
+        # the product cards inside the catalog page, are only counted once, as part of the outer one
+        self.render_starts = []
+
+    def add_query(self, statement, elapsed):
+        self.queries += 1
+        self.sql_time += elapsed
+        self.statements[statement] += 1
+        if elapsed >= self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        # Server-Timing header value, shown by the browser's developer tools next to the request
+        return ", ".join([
+            f'sql;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"',
+            f"render;dur={self.render_time * 1000:.1f}",
+            f"app;dur={self.elapsed() * 1000:.1f}",
+        ])
+
+    def most_repeated(self):
+        # (statement, count) of the statement run most often, the usual sign of a query inside a loop
+        return self.statements.most_common(1)[0] if self.statements else (None, 0)
+
+
+class Instrumentation:
+    # Records the SQL and template rendering time of every request, adds a Server-Timing header, logs one JSON line
+    # per request and warns when a request runs more queries than QUERY_BUDGET. Other code can subscribe to the
+    # finished timings. Follows the init_app pattern of the other extensions
+
+    def __init__(self, app=None):
+        self.subscribers = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('INSTRUMENTATION', True)
+        # Queries a single request may run before a warning is logged
+        app.config.setdefault('QUERY_BUDGET', 20)
+        # One JSON line per request at INFO level, handled by the app's log handler
+        self.logger = logging.getLogger(f"{app.logger.name}.requests")
+        self.logger.setLevel(logging.INFO)
+        app.extensions['instrumentation'] = self
+        if not app.config['INSTRUMENTATION']:
+            return
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        before_render_template.connect(self.start_render, app)
+        template_rendered.connect(self.finish_render, app)
+
+    def watch(self, engine):
+        # Time every statement the engine runs during a request. Call once per engine
+        event.listen(engine, "before_cursor_execute", self.start_query)
+        event.listen(engine, "after_cursor_execute", self.finish_query)
+
+    def subscribe(self, callback):
+        # Call callback(endpoint, method, status, timing) once each request has been sent in full
+        self.subscribers.append(callback)
+
+    @staticmethod
+    def current():
+        # Timing of the request being handled, or None outside of a request
+        return g.get("request_timing") if has_request_context() else None
+
+    def start_request(self):
+        g.request_timing = RequestTiming()
+
+    def start_query(self, connection, cursor, statement, parameters, context, executemany):
+        # Kept on the execution context rather than the connection, so a statement that fails, and never gets its
+        # after_cursor_execute, leaves nothing behind on the pooled connection
+        context._query_start = time.perf_counter()
+
+    def finish_query(self, connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_start
+        timing = self.current()
+        if timing is not None:
+            timing.add_query(statement, elapsed)
+
+    def start_render(self, app, template, context, **extra):
+        timing = self.current()
+        if timing is not None:
+            timing.render_starts.append(time.perf_counter())
+
+    def finish_render(self, app, template, context, **extra):
+        timing = self.current()
+        if timing is not None and timing.render_starts:
+            elapsed = time.perf_counter() - timing.render_starts.pop()
+            if not timing.render_starts:
+                timing.render_time += elapsed
+
+    def finish_request(self, response):
+        timing = self.current()
+        if timing is None:
+            return response
+        # A streamed page is rendered while it is sent, after the headers, so its header only covers the work done
+        # before the first chunk. The log line is written once the whole response has been sent
+        response.headers["Server-Timing"] = timing.server_timing()
+        # The request context is gone by then, so everything the log line needs is read now. The response itself
+        # isn't kept: a reference to it from its own close callback would only let the garbage collector free it
+        status, budget = response.status_code, current_app.config['QUERY_BUDGET']
+        endpoint, method, path = request.endpoint, request.method, request.full_path.rstrip("?")
+        response.call_on_close(lambda: self.log(timing, endpoint, method, path, status, budget))
+        return response
+
+    def log(self, timing, endpoint, method, path, status, budget):
+        record = {
+            "method": method,
+            "path": path,
+            "endpoint": endpoint,
+            "status": status,
+            "duration_ms": round(timing.elapsed() * 1000, 1),
+            "queries": timing.queries,
+            "sql_ms": round(timing.sql_time * 1000, 1),
+            "slowest_sql_ms": round(timing.slowest_time * 1000, 1),
+            "slowest_sql": (timing.slowest_statement or "")[:STATEMENT_LENGTH] or None,
+            "render_ms": round(timing.render_time * 1000, 1),
+        }
+        self.logger.info(json.dumps(record))
+        if timing.queries > budget:
+            statement, count = timing.most_repeated()
+            self.logger.warning("%s %s ran %d queries, over the budget of %d. Most repeated, %d times: %s",
+                                method, path, timing.queries, budget, count, statement[:STATEMENT_LENGTH])
+        for callback in self.subscribers:
+            callback(endpoint, method, status, timing)
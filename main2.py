@@ -1,14 +1,36 @@
-from flask import Flask, render_template, redirect, url_for, flash, abort
+from flask import Flask, Blueprint, current_app, render_template, redirect, url_for, flash, abort, request, jsonify, \
+    make_response, stream_template, Response, stream_with_context, get_flashed_messages, session
+from markupsafe import Markup
 from flask_bootstrap import Bootstrap
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column, composite, with_polymorphic
+from sqlalchemy import and_, or_, func, text, event, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import load_only, relationship, DeclarativeBase, Mapped, mapped_column, composite, with_polymorphic
 from flask_login import LoginManager, UserMixin, current_user, login_required, login_user, logout_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 import os
+import hashlib
+import hmac
+import json
+import math
+import time
+import click
 from datetime import datetime
 from functools import wraps
 from forms import SignUpForm, LoginForm, ItemForm, BillingForm, OrderForm
+from search import create_search_index, rebuild_search_index, search_item_ids, search_statement, suggest_queries
+from passwords import PasswordHasher, PasswordHasherBusy
+from caching import LRUCache, MISSING, VersionCounter
+from importer import ITEM_COLUMNS, ItemRowValidator, read_rows
+from exporter import EXPORT_FORMATS
+from synthetic import SyntheticData, PASSWORD as SYNTHETIC_PASSWORD, parse_scale
+from migrate import upgrade, downgrade, status as migration_status, check_query_plans, analyze
+from assets import Assets
+from images import ImageVariants
+from instrumentation import Instrumentation
+from metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE, labels
+from database import READ_BIND, RoutingSession, configure_database, apply_sqlite_pragmas, use_read_only_database
 
 # Grab current year - to be displayed in the footer
 CURRENT_YEAR = datetime.now().year
@@ -16,26 +38,28 @@ CURRENT_YEAR = datetime.now().year
 # Load .env file with the SECRET_KEY
 load_dotenv("./.env")
 
-# Create Flask application instance
-app = Flask(__name__)
-# Create a database file called clothing.db or connect to it, if it already exists
-app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///clothing3.db"
-# Set to False disables tracking modifications of objects and uses less memory
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-# Secret key allows Flask-Login to use sessions (allows one to store info specific to a
-# user from one request to another) for authentication
-app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
-
+# Extensions, created unbound at import and initialised for each app by create_app()
 # Packages Bootstrap CSS extension into the app
-Bootstrap(app)
+bootstrap = Bootstrap()
 # SQLAlchemy
-db = SQLAlchemy(app)
-
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 # LoginManager contains the code that lets your application and Flask - Login work together, such as how to
 # load a user from an ID, where to send users when they need to log in, etc
 login_manager = LoginManager()
-# Configure actual application object for login
-login_manager.init_app(app)
+# Hashes and checks passwords in a bounded pool off the request thread
+password_hasher = PasswordHasher()
+# Fingerprinted, bundled and precompressed static files, built by flask build-assets
+assets = Assets()
+# Resized WebP and JPEG variants of the hero slides and item images
+image_variants = ImageVariants()
+# Query count, SQL and render time of every request, sent as a Server-Timing header and logged
+instrumentation = Instrumentation()
+# Request counters, latency histograms and gauges of every worker process, served by /metrics
+metrics = Metrics()
+
+# Routes and commands of the shop, added to the app by create_app(). The commands stay at the top level, e.g.
+# flask import-items
+main = Blueprint("main", __name__, cli_group=None)
 
 
 # Set up admin_only function decorator
@@ -50,6 +74,47 @@ def admin_only(f):
     return decorated_function
 
 
+# Version of the catalog, bumped whenever an item is added, edited or deleted. Kept in a file in the instance
+# folder so every worker process sees the same version without asking the database
+catalog_version = VersionCounter()
+# Rendered catalog pages for anonymous visitors, keyed by URL and catalog version. Sized by create_app()
+page_cache = LRUCache()
+
+
+# Set up anonymous_page_cache function decorator
+def anonymous_page_cache(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Logged in users see per-role links, so only anonymous visitors share cached pages
+        if current_user.is_authenticated:
+            return f(*args, **kwargs)
+        # A new catalog version changes the key, so pages rendered before an item change are never served again
+        key = (request.full_path, catalog_version.current())
+        cached = page_cache.get(key)
+        if cached is MISSING:
+            response = make_response(f(*args, **kwargs))
+            # Only cache complete, successful pages that don't set any cookie
+            if response.status_code != 200 or "Set-Cookie" in response.headers:
+                return response
+            # Renders a streamed page, which may change the session too
+            body = response.get_data()
+            # Flask only adds the session cookie after this returns, so the header can't show it yet. A page that
+            # changed the session, e.g. by adding or reading a flashed message, belongs to this visitor alone
+            if session.modified:
+                return response
+            cached = (body, response.content_type, hashlib.sha256(body).hexdigest())
+            page_cache.set(key, cached, size=len(body))
+        body, content_type, etag = cached
+        response = make_response(body)
+        response.content_type = content_type
+        # Strong ETag of the page content. Browsers revalidate on every visit and get a 304 while it is unchanged
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "public, no-cache"
+        response.vary.add("Cookie")
+        return response.make_conditional(request)
+    return decorated_function
+
+
 # Set up customer _only function decorator
 def customer_only(f):
     @wraps(f)
@@ -62,6 +127,18 @@ def customer_only(f):
     return decorated_function
 
 
+# Set up read_only function decorator
+def read_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Run every query of the route on the read-only connection pool, so long catalog reads never hold up
+        # checkouts and edits on the primary. Only for routes that never write
+        use_read_only_database()
+        # Continue with the route function
+        return f(*args, **kwargs)
+    return decorated_function
+
+
 # Table called 'placed_in' for the many-to-many relationship from item to order
 # association_table = db.Table('placed_in',
 #                              db.Column('item_id', db.ForeignKey('item.id'), primary_key=True),
@@ -71,8 +148,16 @@ def customer_only(f):
 
 class PlacedIn(db.Model):
     __tablename__ = "placed_in"  # Table name
-    item_id = db.Column(db.Integer, db.ForiegnKey('item.id'), primary_key=True)
-    order_num = db.Column(db.Integer, db.ForeignKey('order.order_num'), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    order_num = db.Column(db.Integer, db.ForeignKey('order.order_num'), primary_key=True, index=True)
+    # How many of the item are in the order
+    quantity = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # Price of one item when the order was submitted. Empty while the order is still open
+    unit_price = db.Column(db.Float)
+
+
+# Underlying Table of PlacedIn, used as the secondary table of the many-to-many relationship from Item to Order
+association_table = PlacedIn.__table__
 
 
 # User Database Table
@@ -108,8 +193,8 @@ class User(UserMixin, db.Model):
     # Establish one-to-one relationship from Customer to Billing
     billing = relationship("Billing", uselist=False, back_populates="user")
 
-    # Establish one-to-one relationship from Customer to Order
-    order = relationship("Order", uselist=False, back_populates="user")
+    # Establish one-to-many relationship from Customer to Order: one open order plus the submitted ones
+    order = relationship("Order", back_populates="user")
 
     # Establish many-to-one relationship from Customer to ShippingProvider
     shipping_provider_id = db.Column(db.Integer, db.ForeignKey("shipping_provider.id"))
@@ -202,6 +287,8 @@ class Item(db.Model):
     # Fields
     id = db.Column(db.Integer, primary_key=True)
     img_url = db.Column(db.String, nullable=False)
+    # Key of the resized variants of the image at img_url, empty until they have been made
+    img_key = db.Column(db.String)
     name = db.Column(db.String, nullable=False)
     price = db.Column(db.Float, nullable=False)
     sex = db.Column(db.String)
@@ -210,17 +297,39 @@ class Item(db.Model):
     type = db.Column(db.String)
     weight = db.Column(db.Float)
     color = db.Column(db.String)
+    # Incremented by SQLAlchemy every time the item is updated, used to key the cached product cards
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     # Establish one-to-many relationship from Owner to Item
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     user = relationship("User", back_populates="item")
 
     # Establish one-to-many relationship from Inventory to Item
     inventory_id = db.Column(db.Integer, db.ForeignKey('inventory.id'))
     inventory = relationship("Inventory", back_populates="item")
 
-    # Establish many-to-many relationship from Item to Order
-    order = relationship("Order", secondary=association_table, back_populates="items")
+    # Establish many-to-many relationship from Item to Order. Read only: lines are written through PlacedIn, and
+    # deleting an item must not take the lines of submitted orders with it
+    order = relationship("Order", secondary=association_table, back_populates="items", viewonly=True)
+
+    # Composite indexes for the catalog: an equality filter on a facet, then a price range, then the id
+    # tie-breaker of the keyset pagination, so a filtered page only touches the rows it returns
+    __table_args__ = (
+        db.Index("ix_item_name", "name"),
+        db.Index("ix_item_price_id", "price", "id"),
+        db.Index("ix_item_type_price_id", "type", "price", "id"),
+        db.Index("ix_item_sex_price_id", "sex", "price", "id"),
+        db.Index("ix_item_size_price_id", "size", "price", "id"),
+        db.Index("ix_item_brand_price_id", "brand", "price", "id"),
+        db.Index("ix_item_color_price_id", "color", "price", "id"),
+        # The same facets for the default order by id, so a filtered first page is read in order instead of sorted
+        db.Index("ix_item_type_id", "type", "id"),
+        db.Index("ix_item_sex_id", "sex", "id"),
+        db.Index("ix_item_size_id", "size", "id"),
+        db.Index("ix_item_brand_id", "brand", "id"),
+        db.Index("ix_item_color_id", "color", "id"),
+    )
+    __mapper_args__ = {"version_id_col": version}
 
 
 # class Color(db.Model):
@@ -251,7 +360,7 @@ class Billing(db.Model):
     cvv = db.Column(db.String)
 
     # Establish one-to-one relationship from Customer to Billing
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     user = relationship("User", back_populates="billing")
 
 
@@ -261,17 +370,24 @@ class Order(db.Model):
     order_num = db.Column(db.Integer, primary_key=True)
     order_date = db.Column(db.String)
     total_price = db.Column(db.Float)
+    # "open" while the customer is still adding items, "submitted" once the order is placed
+    status = db.Column(db.String, nullable=False, default="open", server_default="open")
 
-    # Establish one-to-one relationship from Customer to Order
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # Establish one-to-many relationship from Customer to Order
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     user = relationship("User", back_populates="order")
 
     # Establish many-to-one relationship from Order to ShippingProvider
     shipping_provider_id = db.Column(db.Integer, db.ForeignKey('shipping_provider.id'))
     shipping_provider = relationship("ShippingProvider", back_populates="orders")
 
-    # Establish many-to-many relationship from Item to Order
-    items = relationship("Item", secondary=association_table, back_populates="order")
+    # Establish many-to-many relationship from Item to Order. Read only, like Item.order
+    items = relationship("Item", secondary=association_table, back_populates="order", viewonly=True)
+
+    # A customer has at most one open order, even when two add-to-cart requests race to create it
+    __table_args__ = (
+        db.Index("ux_order_open_user_id", "user_id", unique=True, sqlite_where=text("status = 'open'")),
+    )
 
 
 class ShippingProvider(db.Model):
@@ -288,39 +404,697 @@ class ShippingProvider(db.Model):
     orders = relationship("Order", back_populates="shipping_provider")
 
 
-with app.app_context():
+# Columns of Item that the catalog can be filtered by
+FACETS = ("type", "sex", "size", "brand", "color")
+
+
+class ItemFacet(db.Model):
+    # Distinct values of each facet of Item and how many items have them, kept up to date by the
+    # owner item routes so the filter bar never has to scan the item table
+    __tablename__ = "item_facet"  # Table name
+    # Fields
+    facet = db.Column(db.String, primary_key=True)
+    value = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+def facet_values(item):
+    # (facet, value) pairs of an item, skipping facets the item has no value for
+    return [(facet, getattr(item, facet)) for facet in FACETS if getattr(item, facet)]
+
+
+def add_item_to_facets(item):
+    # Increment the count of each of the item's facet values, creating the row the first time a value is seen.
+    # Runs in the caller's transaction, so it is committed together with the item itself
+    for facet, value in facet_values(item):
+        statement = sqlite_insert(ItemFacet).values(facet=facet, value=value, count=1)
+        statement = statement.on_conflict_do_update(index_elements=["facet", "value"],
+                                                    set_={"count": ItemFacet.count + 1})
+        db.session.execute(statement)
+
+
+def remove_item_from_facets(item):
+    # Decrement the count of each of the item's facet values and drop values no item has anymore
+    for facet, value in facet_values(item):
+        db.session.execute(db.update(ItemFacet).where(ItemFacet.facet == facet, ItemFacet.value == value)
+                           .values(count=ItemFacet.count - 1))
+    db.session.execute(db.delete(ItemFacet).where(ItemFacet.count <= 0))
+
+
+def rebuild_facets():
+    # Recount every facet from scratch with one GROUP BY per facet
+    db.session.execute(db.delete(ItemFacet))
+    for facet in FACETS:
+        column = getattr(Item, facet)
+        rows = db.session.query(column, func.count()).filter(column.isnot(None), column != "").group_by(column)
+        for value, count in rows:
+            db.session.add(ItemFacet(facet=facet, value=value, count=count))
+    db.session.commit()
+
+
+def get_facets():
+    # Every facet with its values sorted alphabetically, read straight from the facet table
+    facets = {facet: [] for facet in FACETS}
+    for row in ItemFacet.query.order_by(ItemFacet.facet, func.lower(ItemFacet.value)):
+        facets[row.facet].append(row)
+    return facets
+
+
+def create_schema(target=None):
+    # Create or update the database, run by flask db upgrade rather than every time the app starts
     db.create_all()  # Create database
+    # create_all only creates missing tables, so bring tables created by an older version of the app up to date
+    # with the migrations in migrations/
+    applied = upgrade(db.engine, target)
+    # Create the full-text search index over the item table and the triggers keeping it in sync
+    create_search_index(db.session)
+    # Populate the facet table the first time the app runs against an existing catalog
+    if not db.session.query(ItemFacet.query.exists()).scalar() and db.session.query(Item.query.exists()).scalar():
+        rebuild_facets()
+    return applied
+
+
+# Commands managing the schema: flask db upgrade, downgrade, status and check-plans
+@main.cli.group("db")
+def db_command():
+    pass
+
+
+@db_command.command("upgrade")
+@click.option("--to", "target", type=int, help="Version to upgrade to. Defaults to the latest.")
+def db_upgrade_command(target):
+    # Create missing tables and apply the migrations that haven't been applied yet
+    for version, name in create_schema(target):
+        print(f"Applied {version:04d} {name}")
+
+
+@db_command.command("downgrade")
+@click.option("--to", "target", type=int, help="Version to downgrade to. Defaults to the one before the latest.")
+def db_downgrade_command(target):
+    # Revert applied migrations, by default only the latest one
+    if target is None:
+        applied = [version for version, _, is_applied in migration_status(db.engine) if is_applied]
+        target = applied[-2] if len(applied) > 1 else 0
+    for version, name in downgrade(db.engine, target):
+        print(f"Reverted {version:04d} {name}")
+
+
+@db_command.command("status")
+def db_status_command():
+    # List the migrations and whether each has been applied
+    for version, name, applied in migration_status(db.engine):
+        print(f"{version:04d} {name}: {'applied' if applied else 'pending'}")
+
+
+def hot_queries():
+    # Queries run on every page view or checkout, built by the same functions as the routes with example values, so
+    # the plans checked are those of the SQL the app really sends. Pages are read with one extra row, as they are
+    page = current_app.config['CATALOG_PAGE_SIZE'] + 1
+    return {
+        "user by email": User.query.filter_by(email_address="a@example.com").limit(1),
+        "item by name": Item.query.filter_by(name="Shirt").limit(1),
+        "items by name": db.select(Item.name, Item.id).where(Item.name.in_(["Shirt", "Cap"])),
+        "catalog page": catalog_query("id", "100").limit(page),
+        "catalog page of a type": catalog_query("id", "100", {"type": ["Tops"]}).limit(page),
+        "catalog page of a color by price": catalog_query("price", "10.0:100", {"color": ["Black"]}, 5, 200)
+        .limit(page),
+        "search": search_statement(["shirt"], page),
+        "search results": Item.query.filter(Item.id.in_([1, 2, 3])),
+        "open order of a user": open_order_query(1).limit(1),
+        "billing of a user": Billing.query.filter_by(user_id=1).limit(1),
+        "order contents": order_contents_query(1),
+        "orders holding an item": db.select(PlacedIn.order_num).where(PlacedIn.item_id == 1),
+    }
+
+
+@db_command.command("check-plans")
+def db_check_plans_command():
+    # Fail if a query run on every page view or checkout would scan a whole table instead of using an index, or
+    # would sort a whole result to return one page of it
+    with db.engine.connect() as connection:
+        failures = check_query_plans(connection, hot_queries())
+    for name, plan in failures:
+        print(f"{name}: {plan}")
+    if failures:
+        raise click.ClickException(f"{len(failures)} hot queries scan a whole table or sort to paginate.")
+    print("Every hot query uses an index.")
+
+
+@main.cli.command("build-assets")
+def build_assets_command():
+    # Bundle, fingerprint and precompress the static files into static/dist. Run on every deploy
+    written = assets.build()
+    for name, (target, size, gzip_size, brotli_size) in sorted(written.items()):
+        compressed = ", ".join(f"{encoding} {compressed_size:,}" for encoding, compressed_size
+                               in (("gzip", gzip_size), ("br", brotli_size)) if compressed_size is not None)
+        print(f"{target}: {size:,} bytes" + (f" ({compressed})" if compressed else ""))
+    print(f"Built {len(written)} files.")
+
+
+def store_image_key(item_id, img_url):
+    # Callback of image_variants.process_later() giving the item the variants of its image, unless the image has
+    # been changed again since. The version is bumped like an update through the ORM does, so cached product cards
+    # are rendered again
+    def store(key):
+        db.session.execute(db.update(Item).where(Item.id == item_id, Item.img_url == img_url)
+                           .values(img_key=key, version=Item.version + 1))
+        db.session.commit()
+        # Pages cached before the variants existed link the original image
+        catalog_version.bump()
+    return store
+
+
+# Folders of the static folder whose images get resized variants, linked through static_image_key()
+HERO_IMAGE_FOLDERS = ("assets/img/slide",)
+
+
+@main.cli.command("build-images")
+@click.option("--items/--no-items", default=True, show_default=True,
+              help="Also fetch and process the images of items that have no variants yet.")
+def build_images_command(items):
+    # Make the resized variants of the hero slides, and of the item images that have none yet: imported ones, and
+    # those added while IMAGE_WORKERS was 0 or whose background processing failed
+    if not image_variants.enabled:
+        raise click.ClickException("Pillow is not installed.")
+    static_keys = image_variants.build_static(current_app.static_folder, HERO_IMAGE_FOLDERS)
+    print(f"{len(static_keys)} static images processed.")
+    if not items:
+        return
+    processed = 0
+    for item in db.session.scalars(db.select(Item).where(Item.img_key.is_(None), Item.img_url.isnot(None))):
+        item.img_key = image_variants.process_url(item.img_url)
+        processed += item.img_key is not None
+    db.session.commit()
+    # Pages cached before the variants existed link the original images
+    catalog_version.bump()
+    print(f"{processed} item images processed.")
+
+
+@main.cli.command("rebuild-facets")
+def rebuild_facets_command():
+    # Recount the facet table, e.g. after items were changed outside of the app
+    rebuild_facets()
+    print("Facet index rebuilt.")
+
+
+def import_item_batch(rows, user_id):
+    # Upsert a batch of validated rows, keyed by item name, in one transaction: one query to find which names
+    # already exist, then one executemany INSERT for the new items and one executemany UPDATE for the rest
+    table = Item.__table__
+    existing_ids = dict(db.session.execute(db.select(Item.name, Item.id).where(Item.name.in_(list(rows)))).all())
+    inserts = [dict(values, user_id=user_id, inventory_id=1) for name, values in rows.items()
+               if name not in existing_ids]
+    # Bound parameters can't share a name with a column of the UPDATE, hence the prefix
+    updates = [dict({f"new_{column}": value for column, value in values.items()}, item_id=existing_ids[name])
+               for name, values in rows.items() if name in existing_ids]
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+    if updates:
+        # Bump the version like an update through the ORM does, so cached product cards are rendered again
+        set_values = {column: bindparam(f"new_{column}") for column in ITEM_COLUMNS}
+        db.session.execute(table.update().where(table.c.id == bindparam("item_id"))
+                           .values(version=table.c.version + 1, **set_values), updates)
+        # Prices may have changed, so recompute the totals of the open orders containing the updated items
+        recompute_open_order_totals([update["item_id"] for update in updates])
+    db.session.commit()
+    return len(inserts), len(updates)
+
+
+@main.cli.command("import-items")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]),
+              help="File format. Defaults to the file extension.")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows written per transaction.")
+@click.option("--owner", "owner_email", help="Email address of the owner new items belong to.")
+def import_items_command(file, file_format, batch_size, owner_email):
+    # Stream a CSV or JSON Lines file of items into the catalog, inserting new names and updating existing ones.
+    # Rows are checked with the same rules as the item form, and invalid rows are reported and skipped
+    if file_format is None:
+        file_format = "csv" if file.name.lower().endswith(".csv") else "jsonl"
+    user_id = None
+    if owner_email:
+        owner = User.query.filter_by(email_address=owner_email, type="Owner").first()
+        if not owner:
+            raise click.BadParameter(f"No owner with email address {owner_email}", param_hint="--owner")
+        user_id = owner.id
+
+    validator = ItemRowValidator()
+    inserted = updated = invalid = 0
+    # Rows of the current batch keyed by name, so a name repeated within a batch is only written once
+    batch = {}
+    started = time.perf_counter()
+
+    def write_batch():
+        nonlocal inserted, updated
+        batch_inserted, batch_updated = import_item_batch(batch, user_id)
+        inserted += batch_inserted
+        updated += batch_updated
+        batch.clear()
+        rate = (inserted + updated) / max(time.perf_counter() - started, 1e-9)
+        click.echo(f"{inserted} inserted, {updated} updated, {invalid} invalid ({rate:,.0f} rows/s)", err=True)
+
+    for line_number, row in read_rows(file, file_format):
+        values, errors = validator.validate(row)
+        if errors:
+            invalid += 1
+            click.echo(f"Line {line_number} skipped: {errors}", err=True)
+            continue
+        batch[values["name"]] = values
+        if len(batch) >= batch_size:
+            write_batch()
+    if batch:
+        write_batch()
+
+    # Bring the facet counts, planner statistics and cached catalog pages up to date once for the whole import
+    rebuild_facets()
+    analyze(db.session, "item")
+    db.session.commit()
+    catalog_version.bump()
+    click.echo(f"Done: {inserted} inserted, {updated} updated, {invalid} invalid "
+               f"in {time.perf_counter() - started:.1f}s.")
+
+
+def seed_database(items, seed=0, batch_size=10000):
+    # Fill an empty database with a made-up dataset of the given number of items, with owners, customers, billing
+    # rows, orders and order lines, see synthetic.py. Every generated user's password is synthetic.PASSWORD, hashed
+    # once. Returns {table: rows written}
+    data = SyntheticData(items, seed, password_hasher.hash(SYNTHETIC_PASSWORD))
+    written = {}
+
+    def insert(model, rows):
+        db.session.execute(model.__table__.insert(), rows)
+        written[model.__tablename__] = written.get(model.__tablename__, 0) + len(rows)
+
+    insert(ShippingProvider, data.shipping_providers())
+    for batch in data.users(batch_size):
+        insert(User, batch)
+    insert(Inventory, data.inventories())
+    for batch in data.billing(batch_size):
+        insert(Billing, batch)
+    # Index the items in one pass once they are all in, rather than row by row from the insert trigger, which makes
+    # loading them about three times faster. Creating the search index again puts the trigger back
+    db.session.execute(text("DROP TRIGGER IF EXISTS item_fts_insert"))
+    for batch in data.catalog(batch_size):
+        insert(Item, batch)
+    rebuild_search_index(db.session)
+    for orders, lines in data.orders(batch_size):
+        insert(Order, orders)
+        insert(PlacedIn, lines)
+    create_search_index(db.session)
+    # Count the facets once for the whole catalog, and drop cached pages of whatever was there before
+    rebuild_facets()
+    # Give the query planner statistics of the new rows, so it picks the indexes matching each catalog ordering
+    analyze(db.session)
+    db.session.commit()
+    catalog_version.bump()
+    return written
+
+
+@main.cli.command("seed")
+@click.option("--items", "scale", default="1k", show_default=True,
+              help="Number of items, e.g. 2500, or one of 1k, 10k, 100k and 1m.")
+@click.option("--seed", default=0, show_default=True, help="The same seed always makes the same dataset.")
+@click.option("--batch-size", default=10000, show_default=True, help="Rows written per statement.")
+def seed_command(scale, seed, batch_size):
+    # Fill an empty database with a synthetic dataset for development and benchmarks. Run flask db upgrade first
+    try:
+        items = parse_scale(scale)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--items")
+    if db.session.query(User.query.exists()).scalar() or db.session.query(Item.query.exists()).scalar():
+        raise click.ClickException("The database already has users or items. Seed an empty database.")
+    started = time.perf_counter()
+    written = seed_database(items, seed, batch_size)
+    for table, count in written.items():
+        click.echo(f"{table:18} {count:>10,}")
+    click.echo(f"Done in {time.perf_counter() - started:.1f}s. Every user's password is {SYNTHETIC_PASSWORD!r}.")
+
+
+class CachedUser(UserMixin):
+    # Lightweight stand-in for User holding only the fields current_user is used for, so it can be cached
+    # between requests without holding on to a database session
+    def __init__(self, id, username, type, shipping_provider_id):
+        self.id = id
+        self.username = username
+        self.type = type
+        self.shipping_provider_id = shipping_provider_id
+
+
+# Recently loaded users, keyed by user id. Each worker process has its own cache, and the TTL bounds how long a
+# change made through another process can go unnoticed. Sized by create_app()
+user_cache = LRUCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def remember_changed_user(mapper, connection, user):
+    # Note users changed in this transaction, so their cache entries are dropped once it commits
+    db.session.info.setdefault("changed_user_ids", set()).add(user.id)
+
+
+@event.listens_for(db.session, "after_commit")
+def invalidate_changed_users(session):
+    # Drop the cache entries of users changed in the transaction that just committed
+    for user_id in session.info.pop("changed_user_ids", ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(db.session, "after_rollback")
+def forget_changed_users(session):
+    # Nothing was changed after all
+    session.info.pop("changed_user_ids", None)
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    # Reload the user object from the user ID stored in the session
-    return User.query.get(int(user_id))
+    # Reload the user from the user ID stored in the session, from the cache if it was loaded recently
+    user_id = int(user_id)
+    record = user_cache.get(user_id)
+    if record is MISSING:
+        # Only read the columns current_user needs
+        record = db.session.query(User.id, User.username, User.type, User.shipping_provider_id) \
+            .filter_by(id=user_id).first()
+        # Unknown users are not cached, so a user created later is found
+        if record is None:
+            return None
+        record = tuple(record)
+        user_cache.set(user_id, record)
+    return CachedUser(*record)
+
+
+# Orderings the catalog can be paginated by. Every ordering ends with Item.id so that the order is stable
+# even when several items share the same price
+CATALOG_SORTS = ("id", "price")
+
+
+# Range of the integers SQLite can store
+MIN_SQLITE_INTEGER, MAX_SQLITE_INTEGER = -2 ** 63, 2 ** 63 - 1
+
+
+def parse_catalog_cursor(sort, cursor):
+    # No cursor means the first page
+    if not cursor:
+        return None
+    try:
+        # Price-ordered cursors look like "<price>:<id>", id-ordered cursors are just "<id>"
+        if sort == "price":
+            price, item_id = cursor.split(":")
+            price, item_id = float(price), int(item_id)
+        else:
+            price, item_id = 0.0, int(cursor)
+    except ValueError:
+        # A malformed cursor is a bad request rather than a reason to start again from the first page
+        return abort(400)
+    # SQLite integers are 64-bit, and a larger id would fail when bound to the query rather than match nothing
+    if not MIN_SQLITE_INTEGER <= item_id <= MAX_SQLITE_INTEGER or not math.isfinite(price):
+        return abort(400)
+    return (price, item_id) if sort == "price" else item_id
+
+
+def make_catalog_cursor(sort, item):
+    # Build the cursor pointing just after the given item, in the format parse_catalog_cursor expects
+    if sort == "price":
+        return f"{item.price!r}:{item.id}"
+    return str(item.id)
+
+
+def clamp_page_size(limit):
+    # Fall back to the default page size, and never let a client ask for more than the maximum
+    if limit is None:
+        limit = current_app.config['CATALOG_PAGE_SIZE']
+    return max(1, min(limit, current_app.config['CATALOG_MAX_PAGE_SIZE']))
+
+
+def catalog_query(sort="id", cursor=None, filters=None, min_price=None, max_price=None):
+    # Build the ordered query of the items after the cursor that match the filters. The cursor is checked here,
+    # before anything is sent to the client, but the query itself only runs once it is iterated over
+    after = parse_catalog_cursor(sort, cursor)
+
+    query = Item.query
+    # Narrow the catalog down to the requested facet values and price range
+    for facet, values in (filters or {}).items():
+        query = query.filter(getattr(Item, facet).in_(values))
+    if min_price is not None:
+        query = query.filter(Item.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Item.price <= max_price)
+
+    if sort == "price":
+        # Keyset condition: everything strictly after (price, id) of the last item of the previous page
+        if after is not None:
+            after_price, after_id = after
+            query = query.filter(or_(Item.price > after_price, and_(Item.price == after_price, Item.id > after_id)))
+        return query.order_by(Item.price, Item.id)
+    if after is not None:
+        query = query.filter(Item.id > after)
+    return query.order_by(Item.id)
+
+
+def query_catalog_page(sort="id", cursor=None, limit=None, filters=None, min_price=None, max_price=None,
+                       fields=None):
+    limit = clamp_page_size(limit)
+    if sort not in CATALOG_SORTS:
+        sort = "id"
+    query = catalog_query(sort, cursor, filters, min_price, max_price)
+    # Only read the requested columns, plus the ones the cursor is made of
+    if fields:
+        columns = set(fields) | {"id", "price"}
+        query = query.options(load_only(*(getattr(Item, column) for column in columns)))
+
+    # Read one extra row to find out whether there is another page without running a COUNT
+    items = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = make_catalog_cursor(sort, items[-1])
+    return items, next_cursor
+
+
+class CatalogPage:
+    # A page of the catalog that is read from the database in batches while the template iterates over it, so a
+    # streamed page sends each item as soon as its row arrives. next_page_url is only known after the iteration
+
+    def __init__(self, query, sort, limit):
+        self.query = query
+        self.sort = sort
+        self.limit = limit
+        self.next_page_url = None
+
+    def __iter__(self):
+        last_item = None
+        # Read one extra row to find out whether there is another page without running a COUNT
+        rows = self.query.limit(self.limit + 1).yield_per(current_app.config['STREAM_BATCH_SIZE'])
+        for count, item in enumerate(rows):
+            if count == self.limit:
+                self.next_page_url = catalog_url(after=make_catalog_cursor(self.sort, last_item))
+                break
+            last_item = item
+            yield item
+
+
+def render_page(template_name, **context):
+    # Send the page to the client while it renders when STREAM_TEMPLATES is on, so the header and hero go out
+    # before the catalog rows are read. Otherwise render the whole page first. A streamed page is rendered after
+    # the session cookie was sent, so its template must not call get_flashed_messages(): the messages would never
+    # be removed from the session and would show again on every visit. Read them first and pass them in instead
+    if current_app.config['STREAM_TEMPLATES']:
+        return Response(stream_template(template_name, **context))
+    return render_template(template_name, **context)
+
+
+# Public fields of an item, in the order they appear in JSON
+ITEM_FIELDS = ("id", "name", "img_url", "price", "sex", "size", "brand", "type", "weight", "color")
+
+
+def item_to_dict(item, fields=ITEM_FIELDS):
+    # Plain dictionary of the public fields of an item, or only some of them, used by the JSON variants of
+    # the catalog
+    return {field: getattr(item, field) for field in fields}
+
+
+# Rendered product cards, keyed by item id, item version and the role of the viewer. Sized by create_app()
+fragment_cache = LRUCache()
+
+
+def render_item_cards(items):
+    # Product cards for a page of items, produced one at a time as the items arrive. Each card only depends on the
+    # item and whether the viewer is an owner, a customer or anonymous, so it is rendered once and reused until
+    # the item changes
+    role = current_user.type if current_user.is_authenticated else "Anonymous"
+    for item in items:
+        key = (item.id, item.version, role)
+        card = fragment_cache.get(key)
+        if card is MISSING:
+            card = Markup(render_template("item-card.html", item=item, role=role))
+            fragment_cache.set(key, card, size=len(card))
+        yield card
+
+
+def catalog_filters_from_request():
+    # Facet filters from the query string, e.g. ?type=Tops&color=Red&color=Blue. Repeating a facet matches any
+    # of the given values
+    filters = {}
+    for facet in FACETS:
+        # Empty values come from the "Any" option of the filter form and mean no filter
+        values = [value for value in request.args.getlist(facet) if value]
+        if values:
+            filters[facet] = values
+    return filters
+
+
+def price_from_request(name):
+    # A price bound from the query string. Text that isn't a number is ignored like a missing bound, but "nan" and
+    # "inf" read as numbers and would only give meaningless pages, each cached under its own URL
+    price = request.args.get(name, type=float)
+    if price is not None and not math.isfinite(price):
+        abort(400)
+    return price
+
+
+def catalog_args_from_request():
+    # Grab the paging and filtering arguments from the query string shared by the HTML and JSON variants
+    # of the catalog
+    sort = request.args.get("sort", "id")
+    return {
+        "sort": sort if sort in CATALOG_SORTS else "id",
+        "cursor": request.args.get("after"),
+        "limit": request.args.get("limit", type=int),
+        "filters": catalog_filters_from_request(),
+        "min_price": price_from_request("min_price"),
+        "max_price": price_from_request("max_price"),
+    }
+
+
+def catalog_page_from_request():
+    # Read a whole page of the catalog as described by the query string
+    args = catalog_args_from_request()
+    items, next_cursor = query_catalog_page(**args)
+    return args["sort"], items, next_cursor
+
+
+def catalog_url(**changes):
+    # URL of the home route with the current query string, with some arguments changed or removed (None)
+    args = request.args.to_dict(flat=False)
+    for key, value in changes.items():
+        if value is None:
+            args.pop(key, None)
+        else:
+            args[key] = value
+    return url_for("main.home", **args)
 
 
-@app.route('/')
+@main.route('/')
+@read_only
+@anonymous_page_cache
 def home():
-    items = Item.query.all()  # Query all items from Item Table
-    clothing_types = []   # Array to store the unique clothing types
-    # For each item in queried items...
-    for item in items:
-        # If the item type is not already in clothing_types array, add it to clothing_types
-        if item.type not in clothing_types:
-            clothing_types.append(item.type)
-    # Sort clothing_types array alphabetically
-    clothing_types = sorted(clothing_types, key=str.lower)
+    # The page of items matching the filters in the query string. Its rows are read while the page is rendered
+    args = catalog_args_from_request()
+    query = catalog_query(args["sort"], args["cursor"], args["filters"], args["min_price"], args["max_price"])
+    catalog_page = CatalogPage(query, args["sort"], clamp_page_size(args["limit"]))
+    # Facet values and counts for the filter bar, read from the facet index instead of the item table
+    facets = get_facets()
 
     # If user is logged in already, render index.html with the following arguments
     if current_user.is_authenticated:
-        # return redirect(url_for("dashboard", username=current_user.username))
-        return render_template("index.html", all_items=items, all_types=clothing_types,
-                               current_user=current_user, current_year=CURRENT_YEAR)
+        # return redirect(url_for("main.dashboard", username=current_user.username))
+        return render_page("index.html", catalog_page=catalog_page, item_cards=render_item_cards(catalog_page),
+                           all_types=facets["type"], facets=facets, active_filters=args["filters"],
+                           catalog_url=catalog_url, sort=args["sort"], current_user=current_user,
+                           current_year=CURRENT_YEAR)
 
     # If no user is logged in, render index.html with the following arguments
-    return render_template("index.html", all_items=items, all_types=clothing_types, current_year=CURRENT_YEAR)
+    return render_page("index.html", catalog_page=catalog_page, item_cards=render_item_cards(catalog_page),
+                       all_types=facets["type"], facets=facets, active_filters=args["filters"],
+                       catalog_url=catalog_url, sort=args["sort"], current_year=CURRENT_YEAR)
+
+
+@main.route('/items')
+@read_only
+@anonymous_page_cache
+def items_json():
+    # JSON variant of the catalog, served from the same paging query as the home route
+    sort, items, next_cursor = catalog_page_from_request()
+    return jsonify(items=[item_to_dict(item) for item in items], sort=sort, next_cursor=next_cursor)
+
+
+def search_from_request():
+    # Run the search in the query string and return the query, the matching items in rank order and, when
+    # nothing matched, suggestions of similar queries
+    search_query = request.args.get("q", "").strip()
+    limit = request.args.get("limit", current_app.config['CATALOG_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['CATALOG_MAX_PAGE_SIZE']))
+    item_ids = search_item_ids(db.session, search_query, limit)
+    # Load the matching items with one query and put them back in rank order
+    items_by_id = {item.id: item for item in Item.query.filter(Item.id.in_(item_ids))}
+    items = [items_by_id[item_id] for item_id in item_ids if item_id in items_by_id]
+    suggestions = suggest_queries(db.session, search_query) if search_query and not items else []
+    return search_query, items, suggestions
+
+
+def catalog_api_url(**changes):
+    # URL of the catalog API with the current query string, with some arguments changed
+    args = request.args.to_dict(flat=False)
+    args.update(changes)
+    return url_for("main.api_items", **args)
+
+
+@main.route('/api/items')
+@read_only
+def api_items():
+    # Read-only catalog API for the mobile client and partner feeds. Takes the same filters and cursor as the
+    # home route, plus fields=name,price,... to only return some fields
+    fields = [field for field in request.args.get("fields", "").split(",") if field] or list(ITEM_FIELDS)
+    unknown_fields = [field for field in fields if field not in ITEM_FIELDS]
+    if unknown_fields:
+        return jsonify(error="Unknown fields", fields=unknown_fields, allowed=list(ITEM_FIELDS)), 400
+
+    # Every page of the API only changes when the catalog does, so the validators come from the catalog version
+    # and the URL, and clients that already have the page get a 304 before the database is queried
+    etag = hashlib.sha256(f"{catalog_version.current()}|{request.full_path}".encode()).hexdigest()
+    last_modified = catalog_version.last_modified()
+    not_modified = etag in request.if_none_match if request.if_none_match \
+        else request.if_modified_since is not None and request.if_modified_since >= last_modified
+    if not_modified:
+        response = current_app.response_class(status=304)
+    else:
+        args = catalog_args_from_request()
+        items, next_cursor = query_catalog_page(fields=fields, **args)
+        payload = {
+            "items": [item_to_dict(item, fields) for item in items],
+            "next_cursor": next_cursor,
+            "next": catalog_api_url(after=next_cursor) if next_cursor else None,
+        }
+        # Compact encoding, without the spaces the default encoder adds after separators
+        response = current_app.response_class(json.dumps(payload, separators=(",", ":")), mimetype="application/json")
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers["Cache-Control"] = "public, no-cache"
+    return response
+
+
+@main.route('/search')
+@read_only
+@anonymous_page_cache
+def search():
+    search_query, items, suggestions = search_from_request()
+    facets = get_facets()
+    # Render the results with the catalog template
+    return render_template("index.html", all_items=items, item_cards=render_item_cards(items),
+                           all_types=facets["type"], facets=facets, active_filters={}, catalog_url=catalog_url,
+                           sort="id", search_query=search_query, suggestions=suggestions,
+                           current_user=current_user, current_year=CURRENT_YEAR)
+
 
+@main.route('/search.json')
+@read_only
+@anonymous_page_cache
+def search_json():
+    # JSON variant of the search, for search-as-you-type
+    search_query, items, suggestions = search_from_request()
+    return jsonify(query=search_query, items=[item_to_dict(item) for item in items], suggestions=suggestions)
 
-@app.route('/sign-up', methods=["GET", "POST"])
+
+@main.route('/sign-up', methods=["GET", "POST"])
 def sign_up():
     sign_up_form = SignUpForm()  # Create an instance of the SignUpForm
     if sign_up_form.validate_on_submit():  # If a Submit button is clicked and a POST request is made...
@@ -329,13 +1103,17 @@ def sign_up():
             # Display the following message above the form
             flash("Sorry, this email has already been registered. Please log in instead.")
             # Redirect to the login route
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
         # If no Customer with that email address is found, create a new Customer
         new_user = User()
         # Set username of new_customer to the one entered in the sign up form
         new_user.username = sign_up_form.username.data
         # Set password of new_customer to the one entered in the sign up form after hashing it
-        new_user.password = generate_password_hash(sign_up_form.password.data, method="pbkdf2:sha256", salt_length=8)
+        try:
+            new_user.password = password_hasher.hash(sign_up_form.password.data)
+        except PasswordHasherBusy:
+            # Too many sign ups and logins are being hashed right now
+            return abort(503)
         # Set email_address of new_customer to the one entered in the sign up form
         new_user.email_address = sign_up_form.email.data
         new_user.phone_number = sign_up_form.phone_number.data
@@ -362,14 +1140,14 @@ def sign_up():
         db.session.commit()
         # Log new_customer in
         login_user(new_user)
-        return redirect(url_for("home", username=current_user.username))
+        return redirect(url_for("main.home", username=current_user.username))
         # if sign_up_form.type == "Owner":  # If the user type in sign up form is Owner...
         #     # If an Owner with the same email address is already created ...
         #     if User.query.filter_by(email_address=sign_up_form.email.data).first():
         #         # Display the following message above the form
         #         flash("Sorry, this email has already been registered. Please log in instead.")
         #         # Redirect to the login route
-        #         return redirect(url_for("login"))
+        #         return redirect(url_for("main.login"))
         #     # If no Owner with that email address is found, create a new Owner
         #     new_owner = Owner()
         #     # Set username of new_owner to the one entered in the sign up form
@@ -386,7 +1164,7 @@ def sign_up():
         #     # Log new_owner in
         #     login_user(new_owner)
         #     # Redirect to home route
-        #     return redirect(url_for("home", username=current_user.username))
+        #     return redirect(url_for("main.home", username=current_user.username))
         # # If user type in sign up form is Customer...
         # if sign_up_form.type == "Customer":
         #     # If a Customer with the same email address is already created ...
@@ -394,7 +1172,7 @@ def sign_up():
         #         # Display the following message above the form
         #         flash("Sorry, this email has already been registered. Please log in instead.")
         #         # Redirect to the login route
-        #         return redirect(url_for("login"))
+        #         return redirect(url_for("main.login"))
         #     # If no Customer with that email address is found, create a new Customer
         #     new_customer = Customer()
         #     # Set username of new_customer to the one entered in the sign up form
@@ -422,12 +1200,12 @@ def sign_up():
         #     db.session.commit()
         #     # Log new_customer in
         #     login_user(new_customer)
-        #     return redirect(url_for("home", username=current_user.username))
+        #     return redirect(url_for("main.home", username=current_user.username))
     # If GET request, simply render signup.html with the following arguments
     return render_template("signup.html", form=sign_up_form, current_user=current_user, current_year=CURRENT_YEAR)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@main.route('/login', methods=["GET", "POST"])
 def login():
     # Create an instance of the LoginForm
     login_form = LoginForm()
@@ -441,28 +1219,38 @@ def login():
         requested_user = User.query.filter_by(email_address=login_email).first()
         # If a user/owner/customer with the corresponding email address is found...
         if requested_user:
-            # Check the hash of the entered password. If it matches the one in the database...
-            if check_password_hash(pwhash=requested_user.password, password=login_password):
+            # Check the hash of the entered password
+            try:
+                password_matches = password_hasher.verify(requested_user.password, login_password)
+                # Upgrade hashes made with an older method, work factor or salt length while the password is known
+                if password_matches and password_hasher.needs_rehash(requested_user.password):
+                    requested_user.password = password_hasher.hash(login_password)
+                    db.session.commit()
+            except PasswordHasherBusy:
+                # Too many sign ups and logins are being hashed right now
+                return abort(503)
+            # If it matches the one in the database...
+            if password_matches:
                 # Log in the user
                 login_user(requested_user)
                 # Redirect to home route
-                return redirect(url_for("home", username=current_user.username))
+                return redirect(url_for("main.home", username=current_user.username))
             else:
                 # Otherwise, display a message indicating wrong password
                 flash("Sorry, wrong password! Please try again.")
                 # Redirect to login route
-                return redirect(url_for("login"))
+                return redirect(url_for("main.login"))
         else:
             # If no corresponding email address is found, display a message
             flash("Sorry, that email does not exist! Please try again.")
             # Redirect to login route
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
     # If GET request, simply render login.html with the following arguments
     return render_template("login.html", form=login_form, current_user=current_user,
                            current_year=CURRENT_YEAR)
 
 
-@app.route('/owner-add-item', methods=["GET", "POST"])
+@main.route('/owner-add-item', methods=["GET", "POST"])
 @admin_only
 @login_required
 def owner_add_item():
@@ -477,7 +1265,7 @@ def owner_add_item():
             # Display a message indicating item already exists
             flash("Sorry! You already have an item with this name. Please enter another one.")
             # Redirect back to the owner-add-item route
-            return redirect(url_for("owner_add_item"))
+            return redirect(url_for("main.owner_add_item"))
         # If item doesn't already exist in the database, create a new item
         # Initialize fields of this new item with the information entered in the item form
         item_to_add = Item(
@@ -488,15 +1276,23 @@ def owner_add_item():
             size=owner_add_item_form.size.data,
             brand=owner_add_item_form.brand.data,
             type=owner_add_item_form.type.data,
-            weight=owner_add_item_form.weight.data,
+            weight=owner_add_item_form.weight.data or None,
             color=owner_add_item_form.color.data,
             user_id=current_user.id,
             inventory_id=1
         )
         # Add new item to database
         db.session.add(item_to_add)
+        # Count the new item in the facet index, which also gives it its id
+        add_item_to_facets(item_to_add)
+        item_id = item_to_add.id
         # Commit changes
         db.session.commit()
+        # Pages cached before this item was added are out of date
+        catalog_version.bump()
+        # The resized variants of the image are made in the background. Pages link the original image until then
+        image_url = owner_add_item_form.img_url.data
+        image_variants.process_later(image_url, store_image_key(item_id, image_url))
 
         # Grab colors from the form
         # new_colors = owner_add_item_form.colors.data
@@ -507,13 +1303,13 @@ def owner_add_item():
         #     db.session.commit()  # Commit Changes
 
         # Redirect to home route
-        return redirect(url_for("home", username=current_user.username))
+        return redirect(url_for("main.home", username=current_user.username))
     # If GET request, simply render add-item.html with the following arguments
     return render_template("add-item.html", form=owner_add_item_form, operation="Add", current_user=current_user,
                            current_year=CURRENT_YEAR)
 
 
-@app.route('/edit-item/<int:item_id>', methods=["GET", "POST"])
+@main.route('/edit-item/<int:item_id>', methods=["GET", "POST"])
 @admin_only
 @login_required
 def edit_item(item_id):
@@ -541,7 +1337,7 @@ def edit_item(item_id):
         #     # Display a message indicating item already exists
         #     flash("Sorry! You already have an item with this name. Please enter another one.")
         #     # Redirect back to the edit-item route
-        #     return redirect(url_for("edit_item", item_id=item_id))
+        #     return redirect(url_for("main.edit_item", item_id=item_id))
         # Grab colors from the form
         # new_colors = edit_form.colors.data
         # For each color in new_colors, check if a record with the same color name and item_id exist
@@ -550,8 +1346,18 @@ def edit_item(item_id):
         #         # Display message indicating the item-color combo already exists
         #         flash(f"Sorry! There is already an item with this color: {new_color_name} Please enter another one.")
         #         # Redirect back to the edit-item route
-        #         return redirect(url_for("edit_item", item_id=item_id))
-
+        #         return redirect(url_for("main.edit_item", item_id=item_id))
+
+        # The variants of the old image no longer apply. Those of a new one are made in the background
+        image_changed = edit_form.img_url.data != item_to_edit.img_url
+        if image_changed:
+            item_to_edit.img_key = None
+        # Take the old values of the item out of the facet index before they are overwritten
+        remove_item_from_facets(item_to_edit)
+        # Carry a price change over to the totals of the orders the item is in
+        price_change = float(edit_form.price.data) - float(item_to_edit.price)
+        if price_change:
+            reprice_item_in_orders(item_id, price_change)
         # If item-color combo doesn't exist, update the fields of the item in the database
         item_to_edit.name = edit_form.name.data
         item_to_edit.img_url = edit_form.img_url.data
@@ -560,10 +1366,17 @@ def edit_item(item_id):
         item_to_edit.size = edit_form.size.data
         item_to_edit.brand = edit_form.brand.data
         item_to_edit.type = edit_form.type.data
-        item_to_edit.weight = edit_form.weight.data
+        # An empty weight is stored as NULL, the float column can't hold ''
+        item_to_edit.weight = edit_form.weight.data or None
         item_to_edit.color = edit_form.color.data
+        # Count the new values of the item in the facet index
+        add_item_to_facets(item_to_edit)
         # Commit Changes
         db.session.commit()
+        # Pages cached before this item was edited are out of date
+        catalog_version.bump()
+        if image_changed:
+            image_variants.process_later(edit_form.img_url.data, store_image_key(item_id, edit_form.img_url.data))
 
         # For each color in new_colors, add the color and item_id to the Colors table
         # for new_color_name in new_colors:
@@ -572,13 +1385,13 @@ def edit_item(item_id):
         #     db.session.commit() # Commit Changes
 
         # Redirect to home route
-        return redirect(url_for("home", username=current_user.username))
+        return redirect(url_for("main.home", username=current_user.username))
     # If GET request, simply render add-item.html with the following arguments
     return render_template("add-item.html", form=edit_form, operation="Edit", current_user=current_user,
                            current_year=CURRENT_YEAR)
 
 
-@app.route('/delete-item/<int:item_id>')
+@main.route('/delete-item/<int:item_id>')
 @admin_only
 @login_required
 def delete_item(item_id):
@@ -591,14 +1404,199 @@ def delete_item(item_id):
     #     if color.item_id == item_to_delete.id:
     #         db.session.delete(color)
     #         db.session.commit()
+    # Take the item out of every open order it is in, along with its price from their totals. Lines of submitted
+    # orders are kept, with the price they were placed at
+    reprice_item_in_orders(item_id, -float(item_to_delete.price))
+    open_orders = db.select(Order.order_num).where(Order.status == "open")
+    db.session.execute(db.delete(PlacedIn).where(PlacedIn.item_id == item_id, PlacedIn.order_num.in_(open_orders)))
     # Delete the item from the items table in the database
     db.session.delete(item_to_delete)
+    # Take the item out of the facet index
+    remove_item_from_facets(item_to_delete)
     db.session.commit()  # Commit changes
+    # Pages cached before this item was deleted are out of date
+    catalog_version.bump()
     # Redirect to home route
-    return redirect(url_for("home", username=current_user.username))
+    return redirect(url_for("main.home", username=current_user.username))
 
 
-@app.route('/customer-add-item/<int:item_id>', methods=["GET", "POST"])
+def order_contents_query(order_num):
+    # Items in an order with their quantities, read with a single query joining placed_in to item, so an order
+    # costs one round-trip whatever its size
+    return db.session.query(Item, PlacedIn.quantity).join(PlacedIn, PlacedIn.item_id == Item.id) \
+        .filter(PlacedIn.order_num == order_num).order_by(Item.id)
+
+
+def get_order_contents(order_num):
+    # All the lines of an order at once
+    return order_contents_query(order_num).all()
+
+
+def get_order_total(order_num):
+    # Total price of an order, summed in the database. Used when a total has to be recomputed from scratch
+    return float(db.session.query(func.coalesce(func.sum(Item.price * PlacedIn.quantity), 0)).select_from(PlacedIn)
+                 .join(Item, PlacedIn.item_id == Item.id).filter(PlacedIn.order_num == order_num).scalar())
+
+
+def change_order_total(order_num, amount):
+    # Move the total of an order by amount. The arithmetic happens inside the UPDATE, so concurrent changes to the
+    # same order can't overwrite each other
+    db.session.execute(db.update(Order).where(Order.order_num == order_num)
+                       .values(total_price=func.coalesce(Order.total_price, 0) + amount))
+
+
+def recompute_open_order_totals(item_ids):
+    # Recompute from scratch the totals of the open orders containing any of the items, with one UPDATE
+    line_total = db.select(func.coalesce(func.sum(Item.price * PlacedIn.quantity), 0)).select_from(PlacedIn) \
+        .join(Item, PlacedIn.item_id == Item.id).where(PlacedIn.order_num == Order.order_num).scalar_subquery()
+    orders_with_items = db.select(PlacedIn.order_num).where(PlacedIn.item_id.in_(item_ids))
+    db.session.execute(db.update(Order).where(Order.order_num.in_(orders_with_items), Order.status == "open")
+                       .values(total_price=line_total), execution_options={"synchronize_session": False})
+
+
+def add_to_order(order_num, item, quantity=1):
+    # Insert the order line, or add to its quantity if the item is already in the order
+    statement = sqlite_insert(PlacedIn).values(item_id=item.id, order_num=order_num, quantity=quantity)
+    statement = statement.on_conflict_do_update(index_elements=["item_id", "order_num"],
+                                                set_={"quantity": PlacedIn.quantity + statement.excluded.quantity})
+    db.session.execute(statement)
+    # Add the price of the added quantity to the order total in the same transaction
+    change_order_total(order_num, float(item.price) * quantity)
+
+
+def remove_from_order(order_num, item):
+    # Delete the order line and take the price of its whole quantity off the order total in the same transaction
+    quantity = db.session.execute(db.delete(PlacedIn)
+                                  .where(PlacedIn.order_num == order_num, PlacedIn.item_id == item.id)
+                                  .returning(PlacedIn.quantity)).scalar()
+    if quantity:
+        change_order_total(order_num, -float(item.price) * quantity)
+
+
+def reprice_item_in_orders(item_id, price_change):
+    # Move the total of every order containing the item by the price change times the quantity ordered
+    line_quantity = db.select(PlacedIn.quantity) \
+        .where(PlacedIn.order_num == Order.order_num, PlacedIn.item_id == item_id).scalar_subquery()
+    # Submitted orders keep the prices they were placed at
+    orders_with_item = db.select(PlacedIn.order_num).where(PlacedIn.item_id == item_id)
+    db.session.execute(db.update(Order).where(Order.order_num.in_(orders_with_item), Order.status == "open")
+                       .values(total_price=func.coalesce(Order.total_price, 0) + price_change * line_quantity),
+                       execution_options={"synchronize_session": False})
+
+
+def open_order_query(user_id):
+    # The order the customer is still adding items to
+    return Order.query.filter_by(user_id=user_id, status="open")
+
+
+def get_open_order(user_id):
+    # Query for the order the customer is still adding items to
+    return open_order_query(user_id).first()
+
+
+def get_or_create_order(user_id):
+    # Query for the open order of the customer
+    order = get_open_order(user_id)
+    # If order doesn't yet exist for that customer, create a new order with the following values. The unique index
+    # on open orders turns the insert into a no-op when a concurrent request has just created one, and the order is
+    # read back either way
+    if not order:
+        statement = sqlite_insert(Order).values(
+            order_date=datetime.now().strftime('%B %d, %Y at %I:%M%p'),
+            total_price=0,
+            status="open",
+            user_id=user_id,
+            shipping_provider_id=1
+        ).on_conflict_do_nothing()
+        db.session.execute(statement)
+        order = get_open_order(user_id)
+    return order
+
+
+# Largest quantity of one item a cart request may set
+MAX_ORDER_QUANTITY = 1000
+
+
+def parse_order_changes(payload):
+    # Validate the body of a batch cart request and turn it into {item_id: quantity}.
+    # A later change for the same item replaces an earlier one
+    changes = payload.get("items", []) if isinstance(payload, dict) else None
+    if not isinstance(changes, list):
+        return None
+    quantities = {}
+    for change in changes:
+        if not isinstance(change, dict):
+            return None
+        item_id, quantity = change.get("item_id"), change.get("qty", 1)
+        # bool is a subclass of int, but true/false are not valid ids or quantities
+        if type(item_id) is not int or type(quantity) is not int or quantity < 0:
+            return None
+        # Ids SQLite can't store would fail the query instead of being reported as unknown items, and quantities
+        # beyond any real order would overflow the totals
+        if not MIN_SQLITE_INTEGER <= item_id <= MAX_SQLITE_INTEGER or quantity > MAX_ORDER_QUANTITY:
+            return None
+        quantities[item_id] = quantity
+    return quantities
+
+
+def submit_order(order_num):
+    # Finalize an order with one statement per table, in the caller's transaction.
+    # Snapshot the current price of every line of the order
+    item_price = db.select(Item.price).where(Item.id == PlacedIn.item_id).scalar_subquery()
+    db.session.execute(db.update(PlacedIn).where(PlacedIn.order_num == order_num).values(unit_price=item_price),
+                       execution_options={"synchronize_session": False})
+    # Set the total from the snapshotted prices and mark the order as submitted
+    line_total = db.select(func.coalesce(func.sum(PlacedIn.unit_price * PlacedIn.quantity), 0)) \
+        .where(PlacedIn.order_num == Order.order_num).scalar_subquery()
+    db.session.execute(db.update(Order).where(Order.order_num == order_num, Order.status == "open")
+                       .values(total_price=line_total, status="submitted",
+                               order_date=datetime.now().strftime('%B %d, %Y at %I:%M%p')),
+                       execution_options={"synchronize_session": False})
+
+
+@main.route('/order-items', methods=["POST"])
+@customer_only
+@login_required
+def update_order_items():
+    # Apply many cart changes in one request and one transaction. The body looks like
+    # {"clear": false, "items": [{"item_id": 1, "qty": 2}, {"item_id": 5, "qty": 0}]} where qty is the new quantity
+    # of the item in the order (0 removes it) and "clear" empties the order before the changes are applied
+    payload = request.get_json(silent=True)
+    quantities = parse_order_changes(payload)
+    if quantities is None:
+        return jsonify(error="Expected {\"items\": [{\"item_id\": <int>, \"qty\": <int from 0 to "
+                             f"{MAX_ORDER_QUANTITY}>}}, ...]}}"), 400
+    # Check every item exists with a single query
+    known_ids = {row.id for row in db.session.query(Item.id).filter(Item.id.in_(quantities))}
+    unknown_ids = sorted(set(quantities) - known_ids)
+    if unknown_ids:
+        return jsonify(error="Unknown items", item_ids=unknown_ids), 400
+
+    order = get_or_create_order(current_user.id)
+    # Empty the order, or just remove the items set to 0, with one DELETE
+    removed_ids = [item_id for item_id, quantity in quantities.items() if quantity == 0]
+    if payload.get("clear"):
+        db.session.execute(db.delete(PlacedIn).where(PlacedIn.order_num == order.order_num))
+    elif removed_ids:
+        db.session.execute(db.delete(PlacedIn).where(PlacedIn.order_num == order.order_num,
+                                                     PlacedIn.item_id.in_(removed_ids)))
+    # Insert or overwrite the remaining lines with one multi-row upsert
+    lines = [{"item_id": item_id, "order_num": order.order_num, "quantity": quantity}
+             for item_id, quantity in quantities.items() if quantity > 0]
+    if lines:
+        statement = sqlite_insert(PlacedIn).values(lines)
+        statement = statement.on_conflict_do_update(index_elements=["item_id", "order_num"],
+                                                    set_={"quantity": statement.excluded.quantity})
+        db.session.execute(statement)
+    # Recompute the total once for the whole batch, then commit everything together
+    order.total_price = get_order_total(order.order_num)
+    db.session.commit()
+
+    lines = [{"item_id": item.id, "qty": quantity} for item, quantity in get_order_contents(order.order_num)]
+    return jsonify(order_num=order.order_num, total_price=order.total_price, items=lines)
+
+
+@main.route('/customer-add-item/<int:item_id>', methods=["GET", "POST"])
 @customer_only
 @login_required
 def customer_add_item(item_id):
@@ -618,165 +1616,77 @@ def customer_add_item(item_id):
     )
     # If the Submit button is clicked and a POST request is made
     if customer_add_item_form.validate_on_submit():
-        # Grab name from the form
-        item_name = customer_add_item_form.name.data
-        # If an Order already exists for that customer and the Item exists...
-        if Order.query.filter_by(user_id=current_user.id).first() and Item.query.get(name=item_name):
-            # Query for the matching order for that customer
-            matching_order = Order.query.filter_by(user_id=current_user.id)
-            # Query for the matching item to be added
-            matching_item = Item.query.get(name=item_name)
-            # Add a new record to the "placed_in" table using the primary keys of the order and item found
-            item_order_combo_to_add = PlacedIn(item_id=matching_item.id, order_num=matching_order.order_num)
-            db.session.add(item_order_combo_to_add)
-            # # item_order_combo = Item.query.join(association_table).join(Order).\
-            # #     filter((association_table.c.item_id == matching_item.id) &
-            # #            (association_table.c.order_num == matching_order.order_num)).all()
-            #
-            # statement = association_table.insert().values(item_id=matching_item.id, user_id=matching_order.id)
-            # db.session.execute(statement)
-            db.session.commit()
-            # new_item_order_combo = association_table(item_id=matching_item.id, order_num=matching_order.order_num)
-            # db.session.add(new_item_order_combo)
-            # Commit Changes
-            # db.session.commit()
-
-            # Create variable for total price of the items in the order
-            total_price = 0
-            all_item_order_combos = PlacedIn.query.filter_by(order_num=current_user.id)
-            # all_item_order_combos = Item.query.join(association_table).join(Order).\
-            #     filter((association_table.c.order_num == matching_order.order_num)).all()
-            # For each item-order combo in the records of the "placed_in" that are in the order...
-            for item_order in all_item_order_combos:
-                # Query for the item, grab it's price, and add it to the total price
-                item = Item.query.get(id=item_order.item_id)
-                total_price += float(item.price)
-
-            # Query for the order to be edited
-            order_to_edit = Order.query.get(matching_order.order_num)
-            # Update the total_price with the new one that was just calculated
-            order_to_edit.total_price = total_price
-            # Commit changes
-            db.session.commit()
-
-            # Display message indicating item was added to order
-            flash("Item added to order!")
-            # Redirect to view_order page
-            return redirect(url_for("view_order"))
-        else:
-            # If order doesn't yet exist for that customer, create a new order with the following values
-            new_order = Order(
-                order_date=datetime.now().strftime('%B %d, %Y at %I:%M%p'),
-                total_price=0,
-                user_id=current_user.id,
-                shipping_provider_id=1
-            )
-            # Add new order to database and commit changes
-            db.session.add(new_order)
-            db.session.commit()
-            # Query for the matching item to be added
-            matching_item = Item.query.get(name=item_name)
-            # Add a new record to the "placed_in" table using the primary keys of the new order and item found
-            # new_item_order_combo = association_table(item_id=matching_item.id, order_num=new_order.order_num)
-            # db.session.add(new_item_order_combo)
-            # db.session.commit()  # Commit changes
-
-            # item_order_combo = Item.query.join(association_table).join(Order).\
-            #     filter((association_table.c.item_id == matching_item.id) &
-            #            (association_table.c.order_num == matching_order.order_num)).all()
-
-            # statement = association_table.insert().values(item_id=matching_item.id, user_id=new_order.id)
-            # db.session.execute(statement)
-            # db.session.commit()
-            # Create variable for total price of the items in the order
-            total_price = 0
-            all_item_order_combos = Item.query.join(association_table).join(Order). \
-                filter((association_table.c.order_num == new_order.order_num)).all()
-            # For each item-order combo in the records of the "placed_in" that are in the order...
-            for item_order in all_item_order_combos:
-                # Query for the item, grab it's price, and add it to the total price
-                item = Item.query.get(id=item_order.item_id)
-                total_price += float(item.price)
-
-            # Query for the order to be edited
-            order_to_edit = Order.query.get(new_order.order_num)
-            # Update the total_price with the new one that was just calculated
-            order_to_edit.total_price = total_price
-            # Commit changes
-            db.session.commit()
-            # Display message indicating item was added to order
-            flash("Item added to order!")
-            # Redirect to view_order route
-            return redirect(url_for("view_order"))
+        # Query for the order of the customer, creating it if it doesn't exist yet
+        matching_order = get_or_create_order(current_user.id)
+        # Add the item to the "placed_in" table, or one more of it if it is already in the order, and update the
+        # total_price of the order in the same transaction
+        add_to_order(matching_order.order_num, item_to_add)
+        # Commit changes
+        db.session.commit()
+
+        # Display message indicating item was added to order
+        flash("Item added to order!")
+        # Redirect to view_order page
+        return redirect(url_for("main.view_order"))
     # If GET request, simply render customer-add-item.html with the following arguments
     return render_template("customer-add-item.html", form=customer_add_item_form, operation="Add",
                            current_user=current_user, current_year=CURRENT_YEAR)
 
 
-@app.route('/view-order', methods=["GET", "POST"])
+@main.route('/view-order', methods=["GET", "POST"])
 @customer_only
 @login_required
 def view_order():
-    order_price = 0  # total_price of the items
-    order_items = []  # Items in the customers order, to be displayed
     # Query for the Order with the customer_id that matches that of the current user
-    order_to_view = Order.query.filter_by(user_id=current_user.id).first()
-    # Query for all item-order combos in the "placed_in" table that matches the order_num of the queried order
-    all_item_order_combos = Item.query.join(association_table).join(Order). \
-        filter((association_table.c.order_num == order_to_view.order_num)).all()
-    # For each item-order combo in the records of the "placed_in" that are in the order...
-    for item_order in all_item_order_combos:
-        # Query for the item, grab it's price, and add it to the total price
-        item = Item.query.get(id=item_order.item_id)
-        order_price += float(item.price)
-        order_items.append(item)
-    # item_order_combos = association_table.query.filter_by(order_id=order_to_view.order_num).all()
-    # For each item-order combo in the queried item-order combos...
-    # for combo in item_order_combos:
-    #     # Query for the item that matches the item_id in that combo and append the item to order_items
-    #     order_items.append(Item.query.get(item_id=combo.item_id))
-    #     order_price += float(Item.query.get(item_id=combo.item_id).price)
+    order_to_view = get_open_order(current_user.id)
+    # Items in the customers order with their quantities, read with one query. Only a submission needs them all
+    # up front, a page view reads them in batches while the page streams out
+    if not order_to_view:
+        order_items = []
+    elif request.method == "POST":
+        order_items = get_order_contents(order_to_view.order_num)
+    else:
+        order_items = order_contents_query(order_to_view.order_num).yield_per(current_app.config['STREAM_BATCH_SIZE'])
+    # The total is kept up to date as items are added and removed, so it doesn't need to be summed here
+    order_price = (order_to_view.total_price or 0.0) if order_to_view else 0.0
     order_form = OrderForm(
-        order_price=order_price
+        total_price=f"{order_price:.2f}"
     )
     if order_form.validate_on_submit():
-        # delete all items in the order
-        records_to_delete = Item.query.join(association_table).join(Order). \
-            filter((association_table.c.order_num == order_to_view.order_num)).all()
-        for record in records_to_delete:
-            db.session.delete(record)
-            db.session.commit()  # Commit changes
-        order_to_delete_from = Order.query.filter_by(user_id=current_user.id).first()
-        # Delete the item_order combo in the placed_in table with the item_id that matches the queried item
-
-        return render_template("order-submitted.html", current_user=current_user,
+        # There is nothing to submit in an empty order
+        if not order_items:
+            flash("Your order is empty!")
+            return redirect(url_for("main.view_order"))
+        # Snapshot the line prices and mark the order as submitted in a single transaction. The catalog items stay
+        # in the catalog, and the customer's next item starts a new order
+        submit_order(order_to_view.order_num)
+        db.session.commit()  # Commit changes
+
+        return render_template("order_submitted.html", current_user=current_user,
                                current_year=CURRENT_YEAR)
 
-    # Render view-order.html with the order_items passed to it
-    return render_template("view-order.html", form=order_form, order_items=order_items, current_user=current_user,
-                           current_year=CURRENT_YEAR, order_price=order_price)
+    # Render view-order.html with the order_items passed to it, and the flashed messages read before it streams
+    return render_page("view-order.html", form=order_form, order_items=order_items, current_user=current_user,
+                       current_year=CURRENT_YEAR, order_price=order_price, flashed_messages=get_flashed_messages())
 
 
-@app.route('/delete-order-item/<int:item_id>')
+@main.route('/delete-order-item/<int:item_id>')
 @customer_only
 @login_required
 def delete_order_item(item_id):
     # Query for the item to be removed from the order using item_id argument
     item_to_delete = Item.query.get(item_id)
     # Use filter_by instead of get if you want to query with a non-primary key field
-    order_to_delete_from = Order.query.filter_by(user_id=current_user.id).first()
-    # Delete the item_order combo in the placed_in table with the item_id that matches the queried item
-    record_to_delete = Item.query.join(association_table).join(Order). \
-        filter((association_table.c.item_id == item_to_delete.id) &
-               (association_table.c.order_num == order_to_delete_from.order_num)).all()
-    # record_to_delete = association_table.query.get(item_id=item_to_delete.item_id)
-    db.session.delete(record_to_delete)
-    db.session.commit()  # Commit changes
+    order_to_delete_from = get_open_order(current_user.id)
+    # Delete the item_order combo in the placed_in table and take its price off the order total
+    if item_to_delete and order_to_delete_from:
+        remove_from_order(order_to_delete_from.order_num, item_to_delete)
+        db.session.commit()  # Commit changes
     # Redirect to view_order route
-    return redirect(url_for("view_order", username=current_user.username))
+    return redirect(url_for("main.view_order", username=current_user.username))
 
 
-@app.route('/edit-billing/<int:user_id>', methods=["GET", "POST"])
+@main.route('/edit-billing/<int:user_id>', methods=["GET", "POST"])
 @customer_only
 @login_required
 def edit_billing(user_id):
@@ -797,21 +1707,207 @@ def edit_billing(user_id):
         # Commit changes
         db.session.commit()
         # Redirect to edit_billing route
-        return redirect(url_for("edit_billing", username=current_user.username))
+        return redirect(url_for("main.edit_billing", username=current_user.username))
     # If GET request, simply render add-billing.html with the following arguments
     return render_template("add-billing.html", form=billing_form, current_user=current_user,
                            current_year=CURRENT_YEAR)
 
 
-@app.route("/logout")
+# Data that can be exported
+EXPORT_TABLES = ("items", "orders", "order-lines")
+
+
+def export_statement(table):
+    # Query behind each export
+    if table == "items":
+        return db.select(*(getattr(Item, field) for field in ITEM_FIELDS)).order_by(Item.id)
+    if table == "orders":
+        return db.select(Order.order_num, Order.user_id, Order.status, Order.order_date, Order.total_price,
+                         Order.shipping_provider_id).order_by(Order.order_num)
+    # Order lines with the item name and current price. line_total uses the price the line was submitted at, or
+    # the current price while the order is still open. Lines of submitted orders outlive deleted items, hence the
+    # outer join
+    line_price = func.coalesce(PlacedIn.unit_price, Item.price)
+    return db.select(PlacedIn.order_num, PlacedIn.item_id, Item.name, PlacedIn.quantity, PlacedIn.unit_price,
+                     Item.price.label("item_price"), (line_price * PlacedIn.quantity).label("line_total")) \
+        .outerjoin(Item, PlacedIn.item_id == Item.id).order_by(PlacedIn.order_num, PlacedIn.item_id)
+
+
+def export_chunks(table, file_format):
+    # Encoded chunks of an export. The rows are fetched in batches as the chunks are consumed, so memory use stays
+    # the same however many rows there are
+    statement = export_statement(table).execution_options(yield_per=current_app.config['EXPORT_BATCH_SIZE'])
+    result = db.session.execute(statement)
+    encoder, _ = EXPORT_FORMATS[file_format]
+    return encoder(list(result.keys()), result)
+
+
+@main.route("/export/<table>.<file_format>")
+@read_only
+@admin_only
+@login_required
+def export(table, file_format):
+    # Download items, orders or order lines as CSV or JSON Lines, streamed to the client as they are read
+    if table not in EXPORT_TABLES or file_format not in EXPORT_FORMATS:
+        return abort(404)
+    _, mimetype = EXPORT_FORMATS[file_format]
+    return Response(stream_with_context(export_chunks(table, file_format)), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{table}.{file_format}"'})
+
+
+@main.cli.command("export")
+@click.argument("table", type=click.Choice(EXPORT_TABLES))
+@click.option("--format", "file_format", type=click.Choice(list(EXPORT_FORMATS)), default="csv", show_default=True)
+@click.option("--output", type=click.File("w", encoding="utf-8", lazy=True), default="-",
+              help="File to write to. Defaults to standard output.")
+def export_command(table, file_format, output):
+    # Write items, orders or order lines as CSV or JSON Lines, in constant memory
+    for chunk in export_chunks(table, file_format):
+        output.write(chunk)
+
+
+@main.route("/password-hasher-stats")
+@admin_only
+@login_required
+def password_hasher_stats():
+    # Queue depth and totals of the password hashing pool, for sizing PASSWORD_HASH_WORKERS
+    return jsonify(password_hasher.stats())
+
+
+def cache_metrics():
+    # Size and hit/miss counts of the in-process caches
+    samples = []
+    for name, cache in (("page", page_cache), ("fragment", fragment_cache), ("user", user_cache)):
+        stats = cache.stats()
+        samples += [("shop_cache_entries", labels(cache=name), stats["entries"]),
+                    ("shop_cache_bytes", labels(cache=name), stats["bytes"]),
+                    ("shop_cache_hits_total", labels(cache=name), stats["hits"]),
+                    ("shop_cache_misses_total", labels(cache=name), stats["misses"])]
+    return samples
+
+
+def password_hasher_metrics():
+    # Queue depth and totals of the password hashing pool
+    stats = password_hasher.stats()
+    return [("shop_password_hash_workers", "", stats["workers"]),
+            ("shop_password_hash_in_flight", "", stats["in_flight"]),
+            ("shop_password_hash_queued", "", stats["queued"]),
+            ("shop_password_hash_completed_total", "", stats["completed"]),
+            ("shop_password_hash_rejected_total", "", stats["rejected"])]
+
+
+def pool_metrics(engines):
+    # Use of the connection pools of the primary database and the read-only bind
+    samples = []
+    for bind, engine in engines.items():
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            samples += [("shop_db_pool_size", labels(bind=bind or "default"), pool.size()),
+                        ("shop_db_pool_checked_out", labels(bind=bind or "default"), pool.checkedout()),
+                        ("shop_db_pool_overflow", labels(bind=bind or "default"), max(0, pool.overflow()))]
+    return samples
+
+
+@main.route("/metrics")
+def metrics_endpoint():
+    # Metrics of every worker process in the Prometheus text format. Owners can open it in a browser, and a
+    # Prometheus server, which can't log in, sends METRICS_TOKEN as a bearer token instead
+    token = current_app.config['METRICS_TOKEN']
+    if not (token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")):
+        if not current_user.is_authenticated:
+            return login_manager.unauthorized()
+        if current_user.type != "Owner":
+            return abort(403)
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@main.route("/logout")
 @login_required
 def logout():
     # Logout user
     logout_user()
     # Redirect to home route
-    return redirect(url_for("home", current_user=current_user))
+    return redirect(url_for("main.home", current_user=current_user))
+
+
+# Application factory: creates and configures an app without touching the database, so importing this module and
+# starting a worker stay cheap. Run flask db upgrade to create or update the schema
+def create_app(config=None):
+    # Create Flask application instance
+    app = Flask(__name__)
+    # Set to False disables tracking modifications of objects and uses less memory
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Secret key allows Flask-Login to use sessions (allows one to store info specific to a
+    # user from one request to another) for authentication
+    app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
+    # Size and lifetime (seconds) of the cache of logged in users used by Flask-Login
+    app.config['USER_CACHE_SIZE'] = int(os.environ.get("USER_CACHE_SIZE", 1024))
+    app.config['USER_CACHE_TTL'] = int(os.environ.get("USER_CACHE_TTL", 300))
+    # Number of rendered catalog pages kept for anonymous visitors
+    app.config['PAGE_CACHE_SIZE'] = int(os.environ.get("PAGE_CACHE_SIZE", 256))
+    app.config['PAGE_CACHE_MAX_BYTES'] = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    # Number of rendered product cards kept for logged in users, and the memory they may use in total
+    app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get("FRAGMENT_CACHE_SIZE", 20000))
+    app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(os.environ.get("FRAGMENT_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+    # File whose version every worker checks to find out the catalog has changed, in the instance folder
+    app.config['CATALOG_VERSION_FILE'] = os.path.join(app.instance_path, "catalog_version")
+    # Send large pages to the client while they are being rendered, and how many rows to fetch from the database at
+    # a time while doing so
+    app.config['STREAM_TEMPLATES'] = os.environ.get("STREAM_TEMPLATES", "1") == "1"
+    app.config['STREAM_BATCH_SIZE'] = 100
+    # Rows read from the database at a time by exports
+    app.config['EXPORT_BATCH_SIZE'] = 1000
+    # Number of items rendered per page of the catalog, and the largest page a client may ask for with ?limit=
+    app.config['CATALOG_PAGE_SIZE'] = int(os.environ.get("CATALOG_PAGE_SIZE", 24))
+    app.config['CATALOG_MAX_PAGE_SIZE'] = 100
+    # Time the queries and rendering of every request, and warn about requests running more queries than the budget
+    app.config['INSTRUMENTATION'] = os.environ.get("INSTRUMENTATION", "1") == "1"
+    app.config['QUERY_BUDGET'] = int(os.environ.get("QUERY_BUDGET", 20))
+    # Bearer token a Prometheus server sends to read /metrics. Without it only logged in owners can
+    app.config['METRICS_TOKEN'] = os.environ.get("METRICS_TOKEN")
+    # Settings passed in, e.g. by a benchmark, override the ones above
+    app.config.update(config or {})
+    # Create a database file called clothing3.db or connect to it, if it already exists. The URI, SQLite pragmas and
+    # connection pool can be changed from the environment, see database.py
+    configure_database(app)
+
+    # Configure actual application object for each extension. Instrumentation comes first, so its timing covers the
+    # request hooks of all the others
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    bootstrap.init_app(app)
+    db.init_app(app)
+    # Set WAL mode, the busy timeout and the other pragmas on every connection, before the first one is opened, and
+    # time the statements of both engines
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine, app.config)
+        if READ_BIND in db.engines:
+            apply_sqlite_pragmas(db.engines[READ_BIND], app.config, read_only=True)
+        if app.config['INSTRUMENTATION']:
+            for engine in db.engines.values():
+                instrumentation.watch(engine)
+        engines = dict(db.engines)
+    login_manager.init_app(app)
+    password_hasher.init_app(app)
+    assets.init_app(app)
+    image_variants.init_app(app)
+
+    # Size the caches and open the catalog version file
+    os.makedirs(os.path.dirname(app.config['CATALOG_VERSION_FILE']), exist_ok=True)
+    catalog_version.open(app.config['CATALOG_VERSION_FILE'])
+    page_cache.configure(max_entries=app.config['PAGE_CACHE_SIZE'], max_bytes=app.config['PAGE_CACHE_MAX_BYTES'])
+    fragment_cache.configure(max_entries=app.config['FRAGMENT_CACHE_SIZE'],
+                             max_bytes=app.config['FRAGMENT_CACHE_MAX_BYTES'])
+    user_cache.configure(max_entries=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+    # Report the caches, the password hashing pool and the connection pools along with the request metrics
+    metrics.register("caches", cache_metrics)
+    metrics.register("password_hasher", password_hasher_metrics)
+    metrics.register("db_pools", lambda: pool_metrics(engines))
+
+    app.register_blueprint(main)
+    return app
 
 
 # Run app
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,344 @@
+import bisect
+import contextlib
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+# fcntl is POSIX only: without it the snapshots of exited processes are never folded together, only kept
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Upper bounds, in seconds, of the buckets of the request latency histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Type and help text of every metric, in the order they are exposed
+METRICS = {
+    "shop_http_requests_total": ("counter", "Requests handled, by endpoint, method and status."),
+    "shop_http_request_errors_total": ("counter", "Requests answered with a 5xx status."),
+    "shop_http_request_duration_seconds": ("histogram", "Time from the start of a request until it was sent."),
+    "shop_db_queries_total": ("counter", "SQL statements run by requests."),
+    "shop_db_query_seconds_total": ("counter", "Time requests spent running SQL statements."),
+    "shop_template_render_seconds_total": ("counter", "Time requests spent rendering templates."),
+    "shop_db_pool_size": ("gauge", "Connections each pool keeps open."),
+    "shop_db_pool_checked_out": ("gauge", "Connections in use."),
+    "shop_db_pool_overflow": ("gauge", "Connections open beyond the pool size."),
+    "shop_cache_entries": ("gauge", "Entries held by each in-process cache."),
+    "shop_cache_bytes": ("gauge", "Memory used by each in-process cache, as counted by its size limit."),
+    "shop_cache_hits_total": ("counter", "Cache lookups that found an entry."),
+    "shop_cache_misses_total": ("counter", "Cache lookups that found nothing."),
+    "shop_password_hash_workers": ("gauge", "Workers of the password hashing pool."),
+    "shop_password_hash_in_flight": ("gauge", "Password hashing calls running or waiting."),
+    "shop_password_hash_queued": ("gauge", "Password hashing calls waiting for a free worker."),
+    "shop_password_hash_completed_total": ("counter", "Password hashing calls finished."),
+    "shop_password_hash_rejected_total": ("counter", "Password hashing calls turned away because the queue was full."),
+}
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Snapshot file of a running process, <pid>-<start time>.json
+SNAPSHOT_NAME = re.compile(r"(\d+)-\d+\.json")
+# File holding the counters of every process that has exited, added up
+RETIRED_FILE = "retired.json"
+# File locked while the snapshots of exited processes are folded into RETIRED_FILE, so no scrape counts one twice
+LOCK_FILE = "metrics.lock"
+# Flush intervals after which a snapshot that hasn't been written again is taken to belong to an exited process,
+# even if a new process has been given its pid
+RETIRE_AFTER_INTERVALS = 100
+
+
+def labels(**values):
+    # Label set in the text format, e.g. endpoint="main.home",method="GET"
+    return ",".join(f'{name}="{escape(value)}"' for name, value in values.items())
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def sample(name, label_set, value):
+    # One line of the text format
+    value = repr(float(value)) if isinstance(value, float) else str(value)
+    return f"{name}{{{label_set}}} {value}" if label_set else f"{name} {value}"
+
+
+def process_exists(pid):
+    # Signal 0 checks the process exists without sending it anything
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It exists, but belongs to another user
+        return True
+    return True
+
+
+def read_snapshot(path):
+    with open(path) as snapshot_file:
+        return json.load(snapshot_file)
+
+
+def add_counters(totals, snapshot):
+    # Add the counters and histograms of a snapshot to totals, a snapshot-like dict
+    for name, values in snapshot["counters"].items():
+        counters = totals["counters"].setdefault(name, {})
+        for label_set, value in values.items():
+            counters[label_set] = counters.get(label_set, 0) + value
+    for name, values in snapshot["histograms"].items():
+        for label_set, histogram in values.items():
+            total = totals["histograms"].setdefault(name, {}).setdefault(label_set, [0] * len(histogram))
+            for index, value in enumerate(histogram):
+                total[index] += value
+
+
+class ThreadMetrics:
+    # Counters and histograms updated by a single thread, so updating them needs no lock
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, label_set, amount=1):
+        key = (name, label_set)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, label_set, value):
+        # One count per bucket, the last one for values above every bound, followed by the sum of the values
+        histogram = self.histograms.get((name, label_set))
+        if histogram is None:
+            histogram = self.histograms[(name, label_set)] = [0] * (len(DURATION_BUCKETS) + 2)
+        histogram[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+        histogram[-1] += value
+
+    def merge(self, other):
+        # Add the numbers of another thread to these
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, histogram in other.histograms.items():
+            total = self.histograms.setdefault(key, [0] * len(histogram))
+            for index, value in enumerate(histogram):
+                total[index] += value
+
+
+class Metrics:
+    # Request counters and latency histograms fed by the Instrumentation extension, plus gauges and counters read
+    # from other parts of the app by collectors. Every thread updates its own counters, and every worker process
+    # writes a snapshot of its numbers to METRICS_FOLDER every METRICS_FLUSH_INTERVAL seconds. render() adds up the
+    # snapshots of all processes in the Prometheus text format. Follows the init_app pattern of the other extensions
+
+    def __init__(self, app=None):
+        self.collectors = {}
+        self.pid = None
+        self.flusher = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_FOLDER', os.path.join(app.instance_path, "metrics"))
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+        self.folder = app.config['METRICS_FOLDER']
+        self.interval = app.config['METRICS_FLUSH_INTERVAL']
+        os.makedirs(self.folder, exist_ok=True)
+        # Requests are counted when Instrumentation hands over their timing, so it must be set up first
+        instrumentation = app.extensions['instrumentation']
+        if self.observe not in instrumentation.subscribers:
+            instrumentation.subscribe(self.observe)
+        app.extensions['metrics'] = self
+
+    def register(self, name, collector):
+        # collector() returns [(metric name, labels, value)] describing this process. It is called on every flush,
+        # so it should only read counters the code keeps anyway. Registering a name again replaces its collector
+        self.collectors[name] = collector
+
+    def _start_process(self):
+        # Fresh counters for this process, also after a fork: the ones copied from the parent belong to its file.
+        # Also called again to start over, e.g. with another METRICS_FOLDER
+        self.pid = os.getpid()
+        self.local = threading.local()
+        # (thread, its counters) of every thread that has recorded something, and the counters of those that exited
+        self.threads = []
+        self.retired = ThreadMetrics()
+        self.threads_lock = threading.Lock()
+        # The start time keeps a new process that gets the pid of an old one from overwriting its counters
+        self.path = os.path.join(self.folder, f"{self.pid}-{time.time_ns()}.json")
+        # One flusher per process. A fork leaves the parent's behind, and it then no longer counts as alive
+        if self.flusher is None or not self.flusher.is_alive():
+            self.flusher = threading.Thread(target=self._flush_forever, name="metrics-flush", daemon=True)
+            self.flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def thread_metrics(self):
+        # Counters of the calling thread, created the first time it records something
+        if self.pid != os.getpid():
+            self._start_process()
+        metrics = getattr(self.local, "metrics", None)
+        if metrics is None:
+            metrics = self.local.metrics = ThreadMetrics()
+            with self.threads_lock:
+                self.threads.append((threading.current_thread(), metrics))
+        return metrics
+
+    def observe(self, endpoint, method, status, timing):
+        # Called by Instrumentation once a request has been sent
+        metrics = self.thread_metrics()
+        route = labels(endpoint=endpoint or "none", method=method)
+        metrics.count("shop_http_requests_total", f'{route},status="{status}"')
+        if status >= 500:
+            metrics.count("shop_http_request_errors_total", route)
+        metrics.observe("shop_http_request_duration_seconds", route, timing.elapsed())
+        metrics.count("shop_db_queries_total", route, timing.queries)
+        metrics.count("shop_db_query_seconds_total", route, timing.sql_time)
+        metrics.count("shop_template_render_seconds_total", route, timing.render_time)
+
+    def snapshot(self):
+        # Numbers of this process: the counters of every thread added up, and what the collectors report
+        if self.pid != os.getpid():
+            self._start_process()
+        counters, histograms, gauges = {}, {}, {}
+        with self.threads_lock:
+            # Fold the counters of threads that have exited into the process totals and forget them, so a server
+            # starting a thread per request doesn't keep an entry for every thread it has ever run. An exited thread
+            # can't record anything more, so its counters are final
+            alive = []
+            for thread, metrics in self.threads:
+                if thread.is_alive():
+                    alive.append((thread, metrics))
+                else:
+                    self.retired.merge(metrics)
+            self.threads = alive
+            retired = ThreadMetrics()
+            retired.merge(self.retired)
+            threads = [retired] + [metrics for thread, metrics in alive]
+        for metrics in threads:
+            # dict() copies in one step, so a thread adding a key meanwhile can't break the loop
+            for (name, label_set), value in dict(metrics.counters).items():
+                counters.setdefault(name, {})
+                counters[name][label_set] = counters[name].get(label_set, 0) + value
+            for (name, label_set), histogram in dict(metrics.histograms).items():
+                total = histograms.setdefault(name, {}).setdefault(label_set, [0] * len(histogram))
+                for index, value in enumerate(list(histogram)):
+                    total[index] += value
+        for collector in self.collectors.values():
+            for name, label_set, value in collector():
+                target = gauges if METRICS[name][0] == "gauge" else counters
+                target.setdefault(name, {})[label_set] = value
+        return {"time": time.time(), "counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def flush(self):
+        # Write this process's snapshot through a temporary file, so render() never reads half of one
+        snapshot = self.snapshot()
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(temporary_path, self.path)
+
+    @contextlib.contextmanager
+    def locked(self, operation):
+        # Hold LOCK_FILE with flock(operation) for the duration of the block. Yields False when a non-blocking lock
+        # is held by another process, and True without locking anything where fcntl doesn't exist
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(self.folder, LOCK_FILE), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, operation)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    def retire_exited_processes(self):
+        # Add the counters of processes that have exited to RETIRED_FILE and delete their snapshots, so a server
+        # recycling its workers doesn't fill the folder and every scrape reads one file per running process plus one.
+        # Gauges of exited processes no longer matter and are dropped. Skipped while another process does the same
+        if fcntl is None:
+            return
+        with self.locked(fcntl.LOCK_EX | fcntl.LOCK_NB) as acquired:
+            if not acquired:
+                return
+            now = time.time()
+            exited = []
+            for path in glob.glob(os.path.join(self.folder, "*.json")):
+                match = SNAPSHOT_NAME.fullmatch(os.path.basename(path))
+                if match is None or path == self.path:
+                    continue
+                try:
+                    snapshot = read_snapshot(path)
+                except (OSError, ValueError):
+                    continue
+                if not process_exists(int(match.group(1))) \
+                        or now - snapshot["time"] > RETIRE_AFTER_INTERVALS * self.interval:
+                    exited.append((path, snapshot))
+            if not exited:
+                return
+            retired_path = os.path.join(self.folder, RETIRED_FILE)
+            try:
+                retired = read_snapshot(retired_path)
+            except (OSError, ValueError):
+                retired = {"counters": {}, "histograms": {}}
+            for path, snapshot in exited:
+                add_counters(retired, snapshot)
+            retired.update(time=now, gauges={})
+            temporary_path = f"{retired_path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w") as retired_file:
+                json.dump(retired, retired_file)
+            os.replace(temporary_path, retired_path)
+            for path, snapshot in exited:
+                os.remove(path)
+
+    def render(self):
+        # Metrics of every process in the Prometheus text format. Counters of processes that have exited are kept,
+        # so totals never go down, but their gauges are left out once their snapshot is older than three flushes
+        self.flush()
+        self.retire_exited_processes()
+        totals = {"counters": {}, "histograms": {}}
+        gauges = {}
+        now = time.time()
+        # Read while no snapshot is being folded into RETIRED_FILE, which would otherwise be counted twice
+        with self.locked(fcntl.LOCK_SH if fcntl else None):
+            for path in glob.glob(os.path.join(self.folder, "*.json")):
+                try:
+                    snapshot = read_snapshot(path)
+                except (OSError, ValueError):
+                    continue
+                add_counters(totals, snapshot)
+                if now - snapshot["time"] <= 3 * self.interval:
+                    for name, values in snapshot["gauges"].items():
+                        for label_set, value in values.items():
+                            gauges.setdefault(name, {})
+                            gauges[name][label_set] = gauges[name].get(label_set, 0) + value
+        counters, histograms = totals["counters"], totals["histograms"]
+        lines = []
+        for name, (metric_type, help_text) in METRICS.items():
+            values = (histograms if metric_type == "histogram" else gauges if metric_type == "gauge" else counters)
+            if name not in values:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for label_set, value in sorted(values[name].items()):
+                if metric_type == "histogram":
+                    lines.extend(self.render_histogram(name, label_set, value))
+                else:
+                    lines.append(sample(name, label_set, value))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def render_histogram(name, label_set, histogram):
+        # Cumulative _bucket lines, then _sum and _count
+        prefix = f"{label_set}," if label_set else ""
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS + ("+Inf",), histogram[:-1]):
+            cumulative += count
+            yield sample(f"{name}_bucket", f'{prefix}le="{bound}"', cumulative)
+        yield sample(f"{name}_sum", label_set, histogram[-1])
+        yield sample(f"{name}_count", label_set, cumulative)
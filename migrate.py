@@ -0,0 +1,129 @@
+import importlib.util
+import os
+import re
+from datetime import datetime, timezone
+from sqlalchemy import text
+
+# Folder of the migration scripts, named <version>_<name>.py, each with an up(connection) and a down(connection)
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Table recording which migrations have been applied to the database
+VERSION_TABLE = "schema_migrations"
+
+
+def load_migrations(folder=MIGRATIONS_FOLDER):
+    # Every migration script in the folder, as (version, name, module), oldest first
+    migrations = []
+    for filename in sorted(os.listdir(folder)):
+        match = re.fullmatch(r"(\d+)_(\w+)\.py", filename)
+        if match is None:
+            continue
+        spec = importlib.util.spec_from_file_location(f"migrations.{filename[:-3]}", os.path.join(folder, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migrations.append((int(match.group(1)), match.group(2), module))
+    return migrations
+
+
+def applied_versions(connection):
+    # Versions of the migrations already applied
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} "
+                            f"(version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at VARCHAR NOT NULL)"))
+    return {row[0] for row in connection.execute(text(f"SELECT version FROM {VERSION_TABLE}"))}
+
+
+def upgrade(engine, target=None):
+    # Apply every migration up to and including target (all of them by default) that hasn't been applied yet.
+    # Each migration runs in its own transaction together with its version row, so a failing one leaves the
+    # database as it was before it. Returns the (version, name) of the migrations applied
+    done = []
+    for version, name, module in load_migrations():
+        if target is not None and version > target:
+            break
+        with engine.begin() as connection:
+            if version in applied_versions(connection):
+                continue
+            module.up(connection)
+            connection.execute(text(f"INSERT INTO {VERSION_TABLE} (version, name, applied_at) "
+                                    f"VALUES (:version, :name, :applied_at)"),
+                               {"version": version, "name": name,
+                                "applied_at": datetime.now(timezone.utc).isoformat(timespec="seconds")})
+        done.append((version, name))
+    return done
+
+
+def downgrade(engine, target):
+    # Revert every applied migration newer than target, newest first. Returns the (version, name) reverted
+    done = []
+    for version, name, module in reversed(load_migrations()):
+        if version <= target:
+            break
+        with engine.begin() as connection:
+            if version not in applied_versions(connection):
+                continue
+            module.down(connection)
+            connection.execute(text(f"DELETE FROM {VERSION_TABLE} WHERE version = :version"), {"version": version})
+        done.append((version, name))
+    return done
+
+
+def status(engine):
+    # (version, name, applied) of every migration
+    with engine.begin() as connection:
+        applied = applied_versions(connection)
+    return [(version, name, version in applied) for version, name, _ in load_migrations()]
+
+
+# Helpers for the migration scripts. Each one checks the current schema first, so a migration can be applied to
+# a database that create_all() already built with the change in it
+
+def column_names(connection, table):
+    return [row[1] for row in connection.execute(text(f'PRAGMA table_info("{table}")'))]
+
+
+def add_column(connection, table, column, definition):
+    if column not in column_names(connection, table):
+        connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {definition}'))
+
+
+def drop_column(connection, table, column):
+    if column in column_names(connection, table):
+        connection.execute(text(f'ALTER TABLE "{table}" DROP COLUMN {column}'))
+
+
+def create_index(connection, name, table, columns):
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({", ".join(columns)})'))
+
+
+def drop_index(connection, name):
+    connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def analyze(connection, table=None):
+    # Refresh the statistics the query planner uses to choose between indexes, of one table or of all of them
+    connection.execute(text(f'ANALYZE "{table}"' if table else "ANALYZE"))
+
+
+# A line of EXPLAIN QUERY PLAN reading a whole table rather than an index, e.g. "SCAN item" but not
+# "SCAN item USING INDEX ix_item_price_id"
+TABLE_SCAN = re.compile(r"SCAN (\S+)( AS \S+)?")
+
+# A line of EXPLAIN QUERY PLAN sorting the rows after reading them. A paginated query that sorts has to read every
+# matching row before it can return the first page
+TEMP_SORT = "USE TEMP B-TREE FOR ORDER BY"
+
+
+def check_query_plans(connection, queries):
+    # (query name, plan line) for every query that scans a whole table, and every paginated one that sorts its rows
+    # instead of reading them in order from an index. queries maps names to SQLAlchemy statements or ORM queries,
+    # compiled with their values inlined so the plan is the one of the SQL the app sends. Empty when all is well
+    failures = []
+    for name, statement in queries.items():
+        # An ORM query is checked through its select statement
+        statement = getattr(statement, "statement", statement)
+        sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+        paginated = re.search(r"\bLIMIT\b", sql) is not None
+        for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"):
+            if TABLE_SCAN.fullmatch(row[-1]) or (paginated and row[-1] == TEMP_SORT):
+                failures.append((name, row[-1]))
+    return failures
@@ -0,0 +1,20 @@
+# Columns added to existing tables after they were first created: order line quantities and prices, order status
+# and the item version used to key cached product cards
+from migrate import add_column, drop_column
+
+COLUMNS = (
+    ("placed_in", "quantity", "INTEGER NOT NULL DEFAULT 1"),
+    ("placed_in", "unit_price", "FLOAT"),
+    ("order", "status", "VARCHAR NOT NULL DEFAULT 'open'"),
+    ("item", "version", "INTEGER NOT NULL DEFAULT 1"),
+)
+
+
+def up(connection):
+    for table, column, definition in COLUMNS:
+        add_column(connection, table, column, definition)
+
+
+def down(connection):
+    for table, column, _ in reversed(COLUMNS):
+        drop_column(connection, table, column)
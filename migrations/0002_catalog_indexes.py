@@ -0,0 +1,23 @@
+# Indexes of the catalog: item names for the importer, and a facet, price and id for each filter and sort of the
+# keyset pagination
+from migrate import create_index, drop_index
+
+INDEXES = (
+    ("ix_item_name", ("name",)),
+    ("ix_item_price_id", ("price", "id")),
+    ("ix_item_type_price_id", ("type", "price", "id")),
+    ("ix_item_sex_price_id", ("sex", "price", "id")),
+    ("ix_item_size_price_id", ("size", "price", "id")),
+    ("ix_item_brand_price_id", ("brand", "price", "id")),
+    ("ix_item_color_price_id", ("color", "price", "id")),
+)
+
+
+def up(connection):
+    for name, columns in INDEXES:
+        create_index(connection, name, "item", columns)
+
+
+def down(connection):
+    for name, _ in INDEXES:
+        drop_index(connection, name)
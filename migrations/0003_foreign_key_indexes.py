@@ -0,0 +1,21 @@
+# Indexes on the foreign keys looked up on every request: a customer's open order and billing details, the lines
+# of an order and an owner's items. The primary key of placed_in starts with item_id, so it can't find the lines of
+# an order by itself
+from migrate import create_index, drop_index
+
+INDEXES = (
+    ("ix_order_user_id", "order", ("user_id",)),
+    ("ix_billing_user_id", "billing", ("user_id",)),
+    ("ix_placed_in_order_num", "placed_in", ("order_num",)),
+    ("ix_item_user_id", "item", ("user_id",)),
+)
+
+
+def up(connection):
+    for name, table, columns in INDEXES:
+        create_index(connection, name, table, columns)
+
+
+def down(connection):
+    for name, _, _ in INDEXES:
+        drop_index(connection, name)
@@ -0,0 +1,10 @@
+# Key of the resized WebP and JPEG variants made of an item's image, empty until they have been made
+from migrate import add_column, drop_column
+
+
+def up(connection):
+    add_column(connection, "item", "img_key", "VARCHAR")
+
+
+def down(connection):
+    drop_column(connection, "item", "img_key")
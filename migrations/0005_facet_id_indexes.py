@@ -0,0 +1,23 @@
+# A facet and id index for each filter of the catalog in its default order by id. Without them a filtered page is
+# found through the facet, price and id indexes and then every matching row is sorted by id. With a price range as
+# well, the planner needs statistics to prefer these, hence the ANALYZE
+from migrate import create_index, drop_index, analyze
+
+INDEXES = (
+    ("ix_item_type_id", ("type", "id")),
+    ("ix_item_sex_id", ("sex", "id")),
+    ("ix_item_size_id", ("size", "id")),
+    ("ix_item_brand_id", ("brand", "id")),
+    ("ix_item_color_id", ("color", "id")),
+)
+
+
+def up(connection):
+    for name, columns in INDEXES:
+        create_index(connection, name, "item", columns)
+    analyze(connection, "item")
+
+
+def down(connection):
+    for name, _ in INDEXES:
+        drop_index(connection, name)
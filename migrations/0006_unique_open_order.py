@@ -0,0 +1,35 @@
+# At most one open order per customer. Customers who already have several, from add-to-cart requests that raced to
+# create one, keep their oldest open order with the lines of the others added to it
+from sqlalchemy import text
+from migrate import drop_index
+
+
+def up(connection):
+    duplicates = connection.execute(text(
+        'SELECT user_id, MIN(order_num) FROM "order" WHERE status = \'open\' GROUP BY user_id HAVING COUNT(*) > 1'
+    )).all()
+    for user_id, kept in duplicates:
+        extras = [row[0] for row in connection.execute(text(
+            'SELECT order_num FROM "order" WHERE status = \'open\' AND user_id = :user_id AND order_num != :kept'
+        ), {"user_id": user_id, "kept": kept})]
+        for order_num in extras:
+            # WHERE true tells SQLite the ON CONFLICT belongs to the INSERT rather than the SELECT
+            connection.execute(text(
+                "INSERT INTO placed_in (item_id, order_num, quantity) "
+                "SELECT item_id, :kept, quantity FROM placed_in WHERE order_num = :order_num AND true "
+                "ON CONFLICT (item_id, order_num) DO UPDATE SET quantity = placed_in.quantity + excluded.quantity"
+            ), {"kept": kept, "order_num": order_num})
+            connection.execute(text("DELETE FROM placed_in WHERE order_num = :order_num"), {"order_num": order_num})
+            connection.execute(text('DELETE FROM "order" WHERE order_num = :order_num'), {"order_num": order_num})
+        connection.execute(text(
+            'UPDATE "order" SET total_price = (SELECT COALESCE(SUM(item.price * placed_in.quantity), 0) '
+            "FROM placed_in JOIN item ON item.id = placed_in.item_id WHERE placed_in.order_num = :kept) "
+            "WHERE order_num = :kept"
+        ), {"kept": kept})
+    connection.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_order_open_user_id ON "order" (user_id) WHERE status = \'open\''
+    ))
+
+
+def down(connection):
+    drop_index(connection, "ux_order_open_user_id")
@@ -0,0 +1,112 @@
+import atexit
+import os
+import threading
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHasherBusy(Exception):
+    # Raised when the hashing pool already has as much work queued as it is allowed to
+    pass
+
+
+class PasswordHasher:
+    # Runs password hashing and verification in a bounded pool instead of on the request thread, so a burst of
+    # logins can only use as many CPUs as the pool has workers. Follows the init_app pattern of the other extensions
+
+    def __init__(self, app=None):
+        self.executor = None
+        self.lock = threading.Lock()
+        # Counters exposed through stats()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Werkzeug method string, including the work factor, e.g. "pbkdf2:sha256:600000" or "scrypt:32768:8:1".
+        # Hashes stored with any other method or a shorter salt are upgraded on the next successful login
+        app.config.setdefault('PASSWORD_HASH_METHOD',
+                              os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000"))
+        app.config.setdefault('PASSWORD_SALT_LENGTH', 16)
+        # "thread" is enough for pbkdf2 and scrypt, which release the GIL while hashing. "process" isolates the
+        # hashing completely at the cost of pickling every call
+        app.config.setdefault('PASSWORD_HASH_EXECUTOR', "thread")
+        app.config.setdefault('PASSWORD_HASH_WORKERS',
+                              int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 2)))
+        # How many calls may wait for a free worker before new ones are turned away
+        app.config.setdefault('PASSWORD_HASH_MAX_QUEUE', 64)
+        # Seconds a request waits for its hash before giving up
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 30)
+
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.salt_length = app.config['PASSWORD_SALT_LENGTH']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.max_queue = app.config['PASSWORD_HASH_MAX_QUEUE']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        # One pool for the process, however many apps are set up. It is only replaced when its kind or size changes
+        settings = (app.config['PASSWORD_HASH_EXECUTOR'], self.workers)
+        if self.executor is None or settings != self.executor_settings:
+            if self.executor is None:
+                atexit.register(self.shutdown)
+            else:
+                self.executor.shutdown(wait=False)
+            if settings[0] == "process":
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hasher")
+            self.executor_settings = settings
+        app.extensions['password_hasher'] = self
+
+    def shutdown(self):
+        # Stop the pool without waiting for the calls still queued
+        self.executor.shutdown(wait=False)
+
+    def _run(self, function, *args):
+        # Hand the call to the pool and wait for its result, refusing it if the queue is already full
+        with self.lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise PasswordHasherBusy()
+            self.in_flight += 1
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except futures.TimeoutError:
+            # Not the builtin TimeoutError before Python 3.11. The pool is too far behind to answer in time, which
+            # the caller handles the same as a full queue
+            raise PasswordHasherBusy()
+
+    def _done(self, future):
+        with self.lock:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def hash(self, password):
+        # Hash a password with the configured method and salt length
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        # Check a password against a stored hash
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # A hash needs upgrading if it was made with another method or work factor, or with a shorter salt
+        method, _, rest = pwhash.partition("$")
+        salt = rest.partition("$")[0]
+        return method != self.method or len(salt) < self.salt_length
+
+    def stats(self):
+        # Snapshot of the pool for sizing it: calls running or waiting, how many of those are waiting, and totals
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,103 @@
+import re
+from difflib import get_close_matches
+from sqlalchemy import text
+
+# Columns of the item table that are indexed for full-text search
+SEARCH_COLUMNS = ("name", "brand", "color", "type")
+
+# External-content FTS5 table over the item table. Only the index is stored, the text itself is read back
+# from item. prefix='2 3' keeps prefix indexes so "jea*" style queries don't have to scan the whole term list
+CREATE_FTS_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5(
+    {", ".join(SEARCH_COLUMNS)},
+    content='item', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+)
+"""
+
+# Vocabulary of the FTS index (one row per distinct term), used for "did you mean" suggestions
+CREATE_VOCAB_TABLE = "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts_vocab USING fts5vocab(item_fts, 'row')"
+
+# Triggers keeping the FTS index in sync with every insert, update and delete on item, whichever code path
+# makes the change
+_NEW_VALUES = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+_OLD_VALUES = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+_COLUMNS = ", ".join(SEARCH_COLUMNS)
+CREATE_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item BEGIN
+        INSERT INTO item_fts(rowid, {_COLUMNS}) VALUES (new.id, {_NEW_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item BEGIN
+        INSERT INTO item_fts(item_fts, rowid, {_COLUMNS}) VALUES ('delete', old.id, {_OLD_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS item_fts_update AFTER UPDATE ON item BEGIN
+        INSERT INTO item_fts(item_fts, rowid, {_COLUMNS}) VALUES ('delete', old.id, {_OLD_VALUES});
+        INSERT INTO item_fts(rowid, {_COLUMNS}) VALUES (new.id, {_NEW_VALUES});
+    END
+    """,
+)
+
+
+def create_search_index(session):
+    # Check whether the index exists before creating it, so an existing catalog is only indexed once
+    exists = session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'item_fts'")).first()
+    session.execute(text(CREATE_FTS_TABLE))
+    session.execute(text(CREATE_VOCAB_TABLE))
+    for trigger in CREATE_TRIGGERS:
+        session.execute(text(trigger))
+    if not exists:
+        rebuild_search_index(session)
+    session.commit()
+
+
+def rebuild_search_index(session):
+    # Reindex every row of the item table
+    session.execute(text("INSERT INTO item_fts(item_fts) VALUES ('rebuild')"))
+
+
+def search_terms(query):
+    # Split the user's query into lowercase words, dropping any FTS5 syntax characters
+    return re.findall(r"\w+", query.lower())
+
+
+def match_expression(terms):
+    # Every term must match, and the last one is treated as a prefix so results show up while the user types.
+    # Terms are quoted so words like AND/OR/NOT are searched for instead of being read as operators
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search_statement(terms, limit):
+    # Ids of the items matching the terms, best match (lowest bm25 rank) first
+    return text("SELECT rowid FROM item_fts WHERE item_fts MATCH :match ORDER BY rank LIMIT :limit") \
+        .bindparams(match=match_expression(terms), limit=limit)
+
+
+def search_item_ids(session, query, limit):
+    # Ids of the items matching the query, in rank order
+    terms = search_terms(query)
+    if not terms:
+        return []
+    return [row[0] for row in session.execute(search_statement(terms, limit))]
+
+
+def suggest_queries(session, query, max_suggestions=3):
+    # "Did you mean" queries built by replacing each unknown word with the closest indexed terms.
+    # Only terms sharing the first letter are compared, which keeps the candidate list small on large catalogs
+    terms = search_terms(query)
+    suggestions = []
+    for position, term in enumerate(terms):
+        if session.execute(text("SELECT 1 FROM item_fts_vocab WHERE term = :term"), {"term": term}).first():
+            continue
+        first = term[0]
+        candidates = [row[0] for row in session.execute(
+            text("SELECT term FROM item_fts_vocab WHERE term >= :low AND term < :high"),
+            {"low": first, "high": chr(ord(first) + 1)})]
+        for match in get_close_matches(term, candidates, n=max_suggestions, cutoff=0.7):
+            suggestions.append(" ".join(terms[:position] + [match] + terms[position + 1:]))
+    return suggestions[:max_suggestions]
@@ -0,0 +1,176 @@
+import random
+import re
+from datetime import datetime, timedelta
+
+# Named dataset sizes, as numbers of items
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000, "1m": 1000000}
+
+# Password of every generated user, so benchmarks can log in as any of them
+PASSWORD = "password"
+
+# Choices of the item form, with how common each is in the generated catalog
+TYPES = (("Tops", 40), ("Bottoms", 30), ("Footwear", 15), ("Accessories", 15))
+SEXES = (("Unisex", 30), ("Male", 35), ("Female", 35))
+SIZES = (("Small", 30), ("Medium", 45), ("Large", 25))
+COLORS = ("Black", "White", "Grey", "Navy", "Blue", "Red", "Green", "Beige", "Brown", "Pink", "Olive", "Burgundy")
+BRANDS = ("Northwind", "Fabrikam", "Contoso", "Tailspin", "Litware", "Adventure Works", "Proseware", "Wingtip",
+          "Coho", "Lucerne", "Margie's", "Alpine Ski House", "Fourth Coffee", "Woodgrove", "Trey")
+ADJECTIVES = ("Classic", "Slim", "Relaxed", "Vintage", "Essential", "Oversized", "Cropped", "Tailored", "Washed",
+              "Lightweight", "Heavyweight", "Organic", "Ribbed", "Quilted", "Stretch", "Waterproof")
+NOUNS = {
+    "Tops": ("T-Shirt", "Shirt", "Hoodie", "Sweater", "Polo", "Blouse", "Cardigan", "Tank Top", "Jacket"),
+    "Bottoms": ("Jeans", "Chinos", "Shorts", "Joggers", "Skirt", "Trousers", "Leggings", "Cargo Pants"),
+    "Footwear": ("Sneakers", "Boots", "Loafers", "Sandals", "Trainers", "Slip-Ons"),
+    "Accessories": ("Cap", "Beanie", "Scarf", "Belt", "Tote Bag", "Backpack", "Socks", "Gloves", "Sunglasses"),
+}
+# Usual weight in kilograms of an item of each type
+WEIGHTS = {"Tops": 0.3, "Bottoms": 0.5, "Footwear": 0.9, "Accessories": 0.2}
+SHIPPING_PROVIDERS = (("Ground", 30.0), ("Air", 10.0), ("Express", 5.0))
+
+# Generated orders are spread over the year before this date, which is fixed so a seed always gives the same data
+LAST_ORDER_DATE = datetime(2025, 1, 1)
+
+
+def parse_scale(value):
+    # Number of items from a scale name like "100k" or a plain number like "2500"
+    value = value.strip().lower()
+    if value in SCALES:
+        return SCALES[value]
+    match = re.fullmatch(r"(\d+)([km]?)", value)
+    if not match:
+        raise ValueError(f"Not a number of items: {value}")
+    return int(match.group(1)) * {"": 1, "k": 1000, "m": 1000000}[match.group(2)]
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+class SyntheticData:
+    # Rows for every table of the shop, made up from a seed so the same seed always gives the same dataset. Ids are
+    # assigned here rather than by the database, so rows can refer to each other without reading anything back.
+    # Every table is yielded in batches of dicts, ready for executemany inserts
+
+    def __init__(self, items, seed=0, password_hash=""):
+        self.items = items
+        self.seed = seed
+        self.password_hash = password_hash
+        # One owner per thousand items and one customer per twenty, like a marketplace of small shops
+        self.owners = max(1, items // 1000)
+        self.customers = max(10, items // 20)
+        # Prices are needed again for the order totals, so they are drawn once up front
+        rng = random.Random(f"{seed}-prices")
+        self.prices = [round(max(4.0, rng.lognormvariate(3.4, 0.6))) - 0.01 for _ in range(items)]
+
+    def customer_ids(self):
+        return range(self.owners + 1, self.owners + self.customers + 1)
+
+    def shipping_providers(self):
+        return [{"id": index, "travel": travel, "weight": weight}
+                for index, (travel, weight) in enumerate(SHIPPING_PROVIDERS, start=1)]
+
+    def inventories(self):
+        # Every item is stocked in inventory 1, like the items owners add through the site
+        return [{"id": 1, "stock": self.items, "last_updated": LAST_ORDER_DATE.strftime('%B %d, %Y'), "user_id": 1}]
+
+    def users(self, batch_size):
+        rng = random.Random(f"{self.seed}-users")
+        batch = []
+        for user_id in range(1, self.owners + self.customers + 1):
+            user_type = "Owner" if user_id <= self.owners else "Customer"
+            batch.append({
+                "id": user_id,
+                "username": f"{user_type.lower()}{user_id}",
+                "email_address": f"{user_type.lower()}{user_id}@example.com",
+                "password": self.password_hash,
+                "phone_number": f"555-{rng.randrange(10000):04d}",
+                "type": user_type,
+                "shipping_provider_id": rng.randint(1, len(SHIPPING_PROVIDERS)),
+            })
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def billing(self, batch_size):
+        rng = random.Random(f"{self.seed}-billing")
+        batch = []
+        for user_id in self.customer_ids():
+            batch.append({
+                "card_number": f"4{user_id:015d}",
+                "expiry_date": f"{rng.randint(1, 12):02d}/{rng.randint(26, 31)}",
+                "cvv": f"{rng.randrange(1000):03d}",
+                "user_id": user_id,
+            })
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def catalog(self, batch_size):
+        rng = random.Random(f"{self.seed}-items")
+        batch = []
+        for item_id in range(1, self.items + 1):
+            item_type = weighted(rng, TYPES)
+            color = rng.choice(COLORS)
+            batch.append({
+                "id": item_id,
+                # The id keeps names unique, as the item form requires
+                "name": f"{rng.choice(ADJECTIVES)} {color} {rng.choice(NOUNS[item_type])} {item_id}",
+                "img_url": f"https://picsum.photos/seed/{item_id}/640/800",
+                "price": self.prices[item_id - 1],
+                "sex": weighted(rng, SEXES),
+                "size": weighted(rng, SIZES),
+                "brand": rng.choice(BRANDS),
+                "type": item_type,
+                "weight": round(WEIGHTS[item_type] * rng.uniform(0.6, 1.6), 2),
+                "color": color,
+                "user_id": rng.randint(1, self.owners),
+                "inventory_id": 1,
+            })
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def popular_item(self, rng):
+        # Item ids drawn so that a few items are in many orders and most are in few, like real sales
+        return min(self.items, int(self.items * rng.random() ** 3) + 1)
+
+    def orders(self, batch_size):
+        # Yield (orders, placed_in lines) batches. Most customers have a few submitted orders, half of them have an
+        # open one they are still adding to. Submitted lines keep the price they were placed at
+        rng = random.Random(f"{self.seed}-orders")
+        orders, lines = [], []
+        order_num = 0
+        for user_id in self.customer_ids():
+            submitted = rng.choices((0, 1, 2, 3, 5), (20, 35, 25, 15, 5))[0]
+            for status in ["submitted"] * submitted + (["open"] if rng.random() < 0.5 else []):
+                order_num += 1
+                quantities = {}
+                for _ in range(rng.choices((1, 2, 3, 5, 8), (30, 30, 20, 15, 5))[0]):
+                    quantities[self.popular_item(rng)] = rng.choices((1, 2, 3), (80, 15, 5))[0]
+                total = 0.0
+                for item_id, quantity in quantities.items():
+                    price = self.prices[item_id - 1]
+                    total += price * quantity
+                    lines.append({"item_id": item_id, "order_num": order_num, "quantity": quantity,
+                                  "unit_price": price if status == "submitted" else None})
+                order_date = LAST_ORDER_DATE - timedelta(minutes=rng.randrange(365 * 24 * 60))
+                orders.append({
+                    "order_num": order_num,
+                    "order_date": order_date.strftime('%B %d, %Y at %I:%M%p'),
+                    "total_price": round(total, 2),
+                    "status": status,
+                    "user_id": user_id,
+                    "shipping_provider_id": rng.randint(1, len(SHIPPING_PROVIDERS)),
+                })
+            if len(lines) >= batch_size:
+                yield orders, lines
+                orders, lines = [], []
+        if orders:
+            yield orders, lines
@@ -0,0 +1,43 @@
+import os
+import sys
+import pytest
+
+# The modules of the app live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main2
+
+
+@pytest.fixture
+def app(tmp_path):
+    # The app on an empty database of its own, with CSRF checks off so tests can post forms directly
+    app = main2.create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'shop.db'}",
+        "SECRET_KEY": "test",
+        "WTF_CSRF_ENABLED": False,
+        "METRICS_FOLDER": str(tmp_path / "metrics"),
+        "IMAGE_VARIANT_FOLDER": str(tmp_path / "images"),
+        "CATALOG_VERSION_FILE": str(tmp_path / "catalog_version"),
+        # No background image downloads unless a test asks for them
+        "IMAGE_WORKERS": 0,
+    })
+    # The caches are kept at module level, so entries of an earlier test's database would otherwise be served
+    for cache in (main2.page_cache, main2.fragment_cache, main2.user_cache):
+        cache.clear()
+    # So are the metrics: forgetting the process makes the next request start fresh counters in this test's folder
+    main2.metrics.pid = None
+    with app.app_context():
+        main2.create_schema()
+    yield app
+
+
+@pytest.fixture
+def login(app):
+    # login(user_id) gives a test client logged in as the user through the session cookie
+    def client(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+            session["_fresh"] = True
+        return client
+    return client
@@ -0,0 +1,18 @@
+import pytest
+import main2
+from main2 import page_cache
+
+
+@pytest.mark.parametrize("path", ["/", "/items", "/api/items"])
+@pytest.mark.parametrize("query", ["min_price=nan", "min_price=inf", "max_price=-inf", "max_price=NaN"])
+def test_a_price_bound_that_is_not_finite_is_a_bad_request(app, path, query):
+    assert app.test_client().get(f"{path}?{query}").status_code == 400
+    assert page_cache.stats()["entries"] == 0
+
+
+def test_a_finite_price_bound_is_accepted(app):
+    assert app.test_client().get("/items?min_price=5&max_price=100.5").status_code == 200
+
+
+def test_the_catalog_version_file_is_kept_out_of_the_repository(app, tmp_path):
+    assert main2.catalog_version.path == str(tmp_path / "catalog_version")
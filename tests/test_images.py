@@ -0,0 +1,57 @@
+import socket
+import pytest
+import images
+import main2
+from images import ImageError, CheckedRedirectHandler, check_fetch_url, connect_to_public_host
+from main2 import db, Item, User
+
+
+@pytest.mark.parametrize("url", ["file:///etc/passwd", "ftp://example.com/item.jpg", "gopher://example.com/",
+                                 "http:///item.jpg"])
+def test_only_http_and_https_urls_are_fetched(url):
+    with pytest.raises(ImageError):
+        check_fetch_url(url)
+
+
+@pytest.mark.parametrize("address", ["127.0.0.1", "10.0.0.5", "192.168.1.1", "169.254.169.254", "::1", "fd00::1"])
+def test_hosts_that_are_not_on_the_public_internet_are_refused(monkeypatch, address):
+    monkeypatch.setattr(socket, "getaddrinfo", lambda host, port, **options: [
+        (socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))])
+    with pytest.raises(ImageError):
+        connect_to_public_host(("images.example.com", 80), 1)
+
+
+def test_a_host_name_pointing_at_loopback_is_refused_when_fetching(app):
+    with app.app_context(), pytest.raises(ImageError, match="not a public address"):
+        main2.image_variants.fetch("http://localhost:9/item.jpg")
+
+
+def test_a_redirect_is_checked_like_the_first_url():
+    with pytest.raises(ImageError):
+        CheckedRedirectHandler().redirect_request(None, None, 302, "Found", {}, "file:///etc/passwd")
+
+
+def test_variants_are_made_after_the_request_adding_the_item(app, login, monkeypatch):
+    monkeypatch.setitem(app.config, "IMAGE_WORKERS", 1)
+    monkeypatch.setattr(main2.image_variants, "workers", 1)
+    if main2.image_variants.executor is None:
+        monkeypatch.setattr(main2.image_variants, "executor", images.ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(main2.image_variants, "process_url", lambda url: "0123456789abcdef")
+    submitted = []
+    process_later = main2.image_variants.process_later
+    monkeypatch.setattr(main2.image_variants, "process_later",
+                        lambda url, callback: submitted.append(process_later(url, callback)))
+    with app.app_context():
+        owner = User(username="owner", email_address="owner@example.com", password="x", type="Owner")
+        db.session.add(owner)
+        db.session.commit()
+        owner_id = owner.id
+    response = login(owner_id).post("/owner-add-item", data={
+        "name": "Shirt", "img_url": "https://example.com/shirt.jpg", "price": "10", "sex": "Unisex",
+        "size": "Medium", "brand": "Test", "type": "Tops", "weight": "", "color": "Black"})
+    assert response.status_code == 302
+    submitted[0].result(timeout=5)
+    with app.app_context():
+        item = Item.query.filter_by(name="Shirt").one()
+        assert item.img_key == "0123456789abcdef"
+        assert item.version == 2
@@ -0,0 +1,31 @@
+import pytest
+from importer import ItemRowValidator
+
+ROW = {"name": "Shirt", "img_url": "https://example.com/shirt.jpg", "price": "10", "sex": "Unisex", "size": "Medium",
+       "brand": "Test", "type": "Tops", "weight": "0.3", "color": "Black"}
+
+
+@pytest.fixture
+def validator(app):
+    with app.test_request_context():
+        yield ItemRowValidator()
+
+
+def test_a_valid_row_is_converted_to_numbers(validator):
+    values, errors = validator.validate(ROW)
+    assert errors is None
+    assert values["price"] == 10.0 and values["weight"] == 0.3
+
+
+@pytest.mark.parametrize("column", ["price", "weight"])
+@pytest.mark.parametrize("value", ["inf", "-inf", "nan", "1e400", "abc"])
+def test_a_price_or_weight_that_is_not_a_finite_number_is_a_row_error(validator, column, value):
+    values, errors = validator.validate(dict(ROW, **{column: value}))
+    assert values is None
+    assert column in errors
+
+
+def test_a_nan_weight_is_reported_under_weight(validator):
+    values, errors = validator.validate(dict(ROW, weight="nan"))
+    assert values is None
+    assert errors == {"weight": ["Must be a number."]}
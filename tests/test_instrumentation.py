@@ -0,0 +1,17 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from main2 import db, instrumentation
+
+
+def test_a_failing_statement_leaves_no_start_time_behind(app):
+    with app.test_request_context():
+        instrumentation.start_request()
+        timing = instrumentation.current()
+        with db.engine.connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM no_such_table"))
+            connection.execute(text("SELECT 1"))
+            assert "query_starts" not in connection.info
+        assert timing.queries == 1
+        assert timing.statements["SELECT 1"] == 1
@@ -0,0 +1,44 @@
+import json
+import os
+import threading
+import time
+import main2
+import metrics
+
+
+def request_count(snapshot):
+    return sum(snapshot["counters"].get("shop_http_requests_total", {}).values())
+
+
+def test_counters_of_exited_threads_are_kept_in_the_process_totals(app):
+    client = app.test_client()
+    before = request_count(main2.metrics.snapshot())
+    # Each request runs on a thread of its own, like a server starting a thread per connection
+    for _ in range(3):
+        thread = threading.Thread(target=lambda: client.get("/").close())
+        thread.start()
+        thread.join()
+    snapshot = main2.metrics.snapshot()
+    assert request_count(snapshot) == before + 3
+    assert all(thread.is_alive() for thread, metrics in main2.metrics.threads)
+    # Folding them in again on the next snapshot doesn't count them twice
+    assert request_count(main2.metrics.snapshot()) == before + 3
+
+
+def test_snapshots_of_exited_processes_are_folded_into_one_file(app, tmp_path):
+    main2.metrics.render()
+    folder = tmp_path / "metrics"
+    assert main2.metrics.path.startswith(str(folder))
+    # A worker that has exited: Linux never hands out pids above 4194304
+    exited = {"time": time.time(), "gauges": {"shop_db_pool_size": {"": 5}},
+              "counters": {"shop_http_requests_total": {'endpoint="main.home",method="GET",status="200"': 4}},
+              "histograms": {}}
+    for name in ("4194305-1.json", "4194305-2.json"):
+        (folder / name).write_text(json.dumps(exited))
+    assert 'shop_http_requests_total{endpoint="main.home",method="GET",status="200"} 8' in main2.metrics.render()
+    assert sorted(path.name for path in folder.glob("*.json")) == \
+        sorted([metrics.RETIRED_FILE, os.path.basename(main2.metrics.path)])
+    # The retired totals are counted once on the next scrape too, without the gauges of the exited workers
+    text = main2.metrics.render()
+    assert 'shop_http_requests_total{endpoint="main.home",method="GET",status="200"} 8' in text
+    assert "shop_db_pool_size 5" not in text
@@ -0,0 +1,92 @@
+import pytest
+import main2
+from main2 import db, Item, Order, PlacedIn, User
+
+
+def add_item(name, price):
+    item = Item(name=name, img_url="http://127.0.0.1:9/item.jpg", price=price, sex="Unisex", size="Medium",
+                brand="Test", type="Tops", color="Black", inventory_id=1)
+    db.session.add(item)
+    return item
+
+
+def test_deleting_an_item_keeps_the_lines_of_submitted_orders(app, login):
+    with app.app_context():
+        owner = User(username="owner", email_address="owner@example.com", password="x", type="Owner")
+        customer = User(username="customer", email_address="customer@example.com", password="x", type="Customer")
+        db.session.add_all([owner, customer])
+        item, other = add_item("Shirt", 10.0), add_item("Cap", 5.0)
+        db.session.flush()
+        submitted = Order(order_date="", total_price=15.0, status="submitted", user_id=customer.id)
+        open_order = Order(order_date="", total_price=10.0, status="open", user_id=customer.id)
+        db.session.add_all([submitted, open_order])
+        db.session.flush()
+        db.session.add_all([
+            PlacedIn(item_id=item.id, order_num=submitted.order_num, quantity=1, unit_price=10.0),
+            PlacedIn(item_id=other.id, order_num=submitted.order_num, quantity=1, unit_price=5.0),
+            PlacedIn(item_id=item.id, order_num=open_order.order_num, quantity=1),
+        ])
+        db.session.commit()
+        main2.rebuild_facets()
+        owner_id, item_id = owner.id, item.id
+        submitted_num, open_num = submitted.order_num, open_order.order_num
+        # The relationship still reads both orders the item is in
+        assert len(item.order) == 2
+
+    response = login(owner_id).get(f"/delete-item/{item_id}")
+    assert response.status_code == 302
+
+    with app.app_context():
+        assert db.session.get(Item, item_id) is None
+        line = db.session.get(PlacedIn, (item_id, submitted_num))
+        assert line is not None and line.unit_price == 10.0
+        assert db.session.get(PlacedIn, (item_id, open_num)) is None
+        assert db.session.get(Order, open_num).total_price == 0
+
+
+def test_a_flashed_message_shows_once_on_the_streamed_order_page(app, login):
+    app.config["STREAM_TEMPLATES"] = True
+    with app.app_context():
+        customer = User(username="customer", email_address="customer@example.com", password="x", type="Customer")
+        db.session.add(customer)
+        db.session.commit()
+        customer_id = customer.id
+    client = login(customer_id)
+    # Submitting an empty order flashes a message and redirects back to the order
+    assert client.post("/view-order", data={"total_price": "0.00"}).status_code == 302
+    pages = []
+    for _ in range(2):
+        response = client.get("/view-order")
+        pages.append(response.get_data(as_text=True))
+        response.close()
+    assert "Your order is empty!" in pages[0]
+    assert "Your order is empty!" not in pages[1]
+
+
+def add_customer():
+    customer = User(username="customer", email_address="customer@example.com", password="x", type="Customer")
+    db.session.add(customer)
+    db.session.commit()
+    return customer.id
+
+
+@pytest.mark.parametrize("change", [{"item_id": 2 ** 70}, {"item_id": -2 ** 70}, {"item_id": 1, "qty": 2 ** 70},
+                                    {"item_id": 1, "qty": main2.MAX_ORDER_QUANTITY + 1}])
+def test_a_cart_change_out_of_range_is_a_bad_request(app, login, change):
+    with app.app_context():
+        add_item("Shirt", 10.0)
+        customer_id = add_customer()
+    response = login(customer_id).post("/order-items", json={"items": [change]})
+    assert response.status_code == 400
+    assert str(main2.MAX_ORDER_QUANTITY) in response.json["error"]
+
+
+def test_the_largest_quantity_is_accepted(app, login):
+    with app.app_context():
+        item = add_item("Shirt", 10.0)
+        db.session.commit()
+        item_id = item.id
+        customer_id = add_customer()
+    response = login(customer_id).post("/order-items", json={"items": [{"item_id": item_id,
+                                                                        "qty": main2.MAX_ORDER_QUANTITY}]})
+    assert response.status_code == 200
@@ -0,0 +1,27 @@
+from flask import flash
+from main2 import anonymous_page_cache, page_cache
+
+
+def test_a_page_changing_the_session_is_not_cached(app):
+    @app.route("/flashing")
+    @anonymous_page_cache
+    def flashing():
+        flash("Only for this visitor")
+        return "page"
+
+    response = app.test_client().get("/flashing")
+    assert response.status_code == 200
+    assert "session=" in response.headers.get("Set-Cookie", "")
+    assert page_cache.stats()["entries"] == 0
+    # Another visitor runs the view again instead of getting the first one's page
+    assert "session=" in app.test_client().get("/flashing").headers.get("Set-Cookie", "")
+
+
+def test_an_anonymous_page_is_cached(app):
+    @app.route("/plain")
+    @anonymous_page_cache
+    def plain():
+        return "page"
+
+    assert app.test_client().get("/plain").status_code == 200
+    assert page_cache.stats()["entries"] == 1
@@ -0,0 +1,43 @@
+import threading
+import pytest
+import passwords
+from main2 import db, User
+from passwords import PasswordHasher, PasswordHasherBusy
+
+
+@pytest.fixture
+def slow_hashing(monkeypatch):
+    # Password checks that block until the test releases them, so every call outlives its timeout
+    release = threading.Event()
+    monkeypatch.setattr(passwords, "check_password_hash", lambda pwhash, password: release.wait(5))
+    yield
+    release.set()
+
+
+def test_a_call_outliving_its_timeout_is_refused(app, slow_hashing):
+    app.config["PASSWORD_HASH_TIMEOUT"] = 0.05
+    hasher = PasswordHasher(app)
+    with pytest.raises(PasswordHasherBusy):
+        hasher.verify("pbkdf2:sha256:1$salt$hash", "password")
+    hasher.shutdown()
+
+
+def test_login_answers_503_when_hashing_times_out(app, slow_hashing):
+    app.extensions["password_hasher"].timeout = 0.05
+    with app.app_context():
+        db.session.add(User(username="customer", email_address="customer@example.com", password="pbkdf2:sha256:1$s$h",
+                            type="Customer"))
+        db.session.commit()
+    response = app.test_client().post("/login", data={"email": "customer@example.com", "password": "password"})
+    assert response.status_code == 503
+
+
+def test_setting_up_another_app_reuses_the_pool(app):
+    hasher = PasswordHasher(app)
+    executor = hasher.executor
+    hasher.init_app(app)
+    assert hasher.executor is executor
+    app.config["PASSWORD_HASH_WORKERS"] = hasher.workers + 1
+    hasher.init_app(app)
+    assert hasher.executor is not executor and executor._shutdown
+    hasher.shutdown()
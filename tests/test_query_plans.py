@@ -0,0 +1,15 @@
+from sqlalchemy import text
+from main2 import db, hot_queries
+from migrate import check_query_plans
+
+
+def test_every_hot_query_uses_an_index(app):
+    with app.app_context(), db.engine.connect() as connection:
+        assert check_query_plans(connection, hot_queries()) == []
+
+
+def test_a_paginated_query_sorting_its_rows_is_reported(app):
+    with app.app_context(), db.engine.connect() as connection:
+        connection.execute(text("DROP INDEX ix_item_type_id"))
+        failures = check_query_plans(connection, hot_queries())
+    assert ("catalog page of a type", "USE TEMP B-TREE FOR ORDER BY") in failures